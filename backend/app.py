@@ -3,23 +3,32 @@ AccessGuru FastAPI Application
 Provides endpoints for accessibility violation prediction and SHAP explanations
 """
 
+import os
+
+# Single-row predictions spend most of their time in OpenMP fork/join, so keep
+# one thread per process (scale with worker processes instead). This has to be
+# set before xgboost / numpy load their threading runtimes.
+os.environ.setdefault("OMP_NUM_THREADS", "1")
+
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field
-from typing import Dict, List, Any
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel, ConfigDict, Field
+from typing import Dict, List, Tuple, Any
 import numpy as np
-import pandas as pd
 import xgboost as xgb
-
-# NOTE: SHAP / NumPy compatibility shim (you had this already)
-np.obj2sctype = lambda obj: np.dtype(obj).type
-
-import shap
 import pickle
 import re
-from bs4 import BeautifulSoup
+import asyncio
+from collections import Counter, OrderedDict
+from html.parser import HTMLParser
+from bs4.dammit import EntitySubstitution
 import warnings
-import os
+
+try:
+    import treelite_runtime
+except ImportError:  # optional native predictor, see train_model.compile_treelite_library
+    treelite_runtime = None
 
 warnings.filterwarnings("ignore")
 
@@ -30,6 +39,7 @@ app = FastAPI(
     title="AccessGuru ML API",
     description="Accessibility violation prediction and explainability API",
     version="1.0.0",
+    default_response_class=ORJSONResponse,
 )
 
 app.add_middleware(
@@ -42,8 +52,14 @@ app.add_middleware(
 
 # Globals
 model: xgb.Booster | None = None
+tl_predictor = None  # treelite_runtime.Predictor when a compiled library is available
 artifacts: dict | None = None
-explainer: shap.TreeExplainer | None = None
+
+# Column layout of the model input, cached from artifacts at load time
+feature_names: Tuple[str, ...] = ()
+feature_index: Dict[str, int] = {}
+# Violation score for each model class index (reverse_mapping as an array)
+class_scores: np.ndarray = np.empty(0, dtype=np.int32)
 
 
 # -----------------------------
@@ -57,8 +73,8 @@ class PredictionInput(BaseModel):
     web_URL: str = Field(..., description="URL of the webpage")
     domain_category: str = Field(..., description="Domain category (e.g., education, government)")
 
-    class Config:
-        json_schema_extra = {
+    model_config = ConfigDict(
+        json_schema_extra={
             "example": {
                 "affected_html_elements": '<img src="logo.png">',
                 "supplementary_information": '<div><img src="logo.png"></div>',
@@ -68,6 +84,7 @@ class PredictionInput(BaseModel):
                 "domain_category": "education",
             }
         }
+    )
 
 
 class PredictionOutput(BaseModel):
@@ -95,109 +112,383 @@ def _encode_tag(tag: str) -> int:
     return le_tag_classes.index("unknown") if "unknown" in le_tag_classes else 0
 
 
-def extract_features_from_input(input_data: PredictionInput) -> pd.DataFrame:
+_TAG_START_RE = re.compile(rb"<([a-zA-Z0-9]+)")
+_CONTRAST_RE = re.compile(r"contrastratio':\s*([0-9.]+)")
+_FONT_SIZE_RE = re.compile(r"fontsize':\s*['\"]([0-9.]+)")
+
+# Mirrors the BeautifulSoup "html.parser" tree builder used at training time
+# (same stdlib tokenizer, same void-tag / string-container rules) so the
+# streamed stats match soup.find_all(...) without building a tree.
+_VOID_TAGS = frozenset((
+    "area", "base", "br", "col", "embed", "hr", "img", "input", "keygen", "link",
+    "menuitem", "meta", "param", "source", "track", "wbr", "basefont", "bgsound",
+    "command", "frame", "image", "isindex", "nextid", "spacer",
+))
+_STRING_CONTAINER_TAGS = frozenset(("rt", "rp", "style", "script", "template"))
+_PRESERVE_WS_TAGS = frozenset(("pre", "textarea"))
+
+# Tag name -> the count feature it feeds, so the parse pass fills the
+# feature counters directly.
+_TAG_COUNT_FEATURES = {
+    "a": "num_links",
+    "img": "num_images", "svg": "num_images",
+    "button": "num_buttons",
+    "input": "num_inputs",
+    "ul": "num_lists", "ol": "num_lists", "li": "num_lists",
+    "h1": "num_headings", "h2": "num_headings", "h3": "num_headings",
+    "h4": "num_headings", "h5": "num_headings", "h6": "num_headings",
+    "form": "has_form",
+    "div": "num_divs",
+    "span": "num_spans",
+    "script": "has_script_or_style", "style": "has_script_or_style",
+}
+
+
+class _TagStatsParser(HTMLParser):
+    """Single-pass tag feature counts + per-tag text length (BS4 get_text semantics).
+
+    Like bs4's html.parser builder, character and entity references are
+    resolved by the handlers below rather than by HTMLParser itself
+    (convert_charrefs=False), and CDATA sections count as text.
+    """
+
+    def __init__(self, check_style: bool = True):
+        super().__init__(convert_charrefs=False)
+        self.counts: Counter = Counter()
+        self.total_text_len = 0  # sum of len(tag.get_text()) over all tags
+        self.tag_count = 0
+        self.has_inline_style = False
+        self._check_style = check_style  # attr scan until a style= is found
+        self._open: List[tuple] = []  # (tag, string_container)
+        self._open_kinds: Counter = Counter()  # open tags per string_container
+        self._containers: List[str] = []
+        self._closed_void: List[str] = []
+        self._data: List[str] = []
+
+    def _flush_data(self):
+        if not self._data:
+            return
+        data = "".join(self._data)
+        self._data = []
+        # BS4 collapses whitespace-only strings outside <pre>/<textarea>
+        if not data.strip(" \n\t\f\r") and not any(e[0] in _PRESERVE_WS_TAGS for e in self._open):
+            data = "\n" if "\n" in data else " "
+        # a string counts once toward every open tag that would include it in
+        # get_text(); text inside <script>/<style>/... only counts for that container
+        kind = self._containers[-1] if self._containers else None
+        self.total_text_len += len(data) * self._open_kinds[kind]
+
+    def _push(self, tag, attrs):
+        self._flush_data()
+        feat = _TAG_COUNT_FEATURES.get(tag)
+        if feat is not None:
+            self.counts[feat] += 1
+        if self._check_style and any(k == "style" for k, _ in attrs):
+            self.has_inline_style = True
+            self._check_style = False
+        container = tag if tag in _STRING_CONTAINER_TAGS else None
+        self.tag_count += 1
+        self._open.append((tag, container))
+        self._open_kinds[container] += 1
+        if container:
+            self._containers.append(container)
+
+    def _pop_to(self, tag):
+        self._flush_data()
+        for i in range(len(self._open) - 1, -1, -1):
+            if self._open[i][0] == tag:
+                for _, container in self._open[i:]:
+                    self._open_kinds[container] -= 1
+                    if container:
+                        self._containers.pop()
+                del self._open[i:]
+                return
+
+    def handle_starttag(self, tag, attrs):
+        self._push(tag, attrs)
+        if tag in _VOID_TAGS:
+            self._pop_to(tag)
+            self._closed_void.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        self._push(tag, attrs)
+        self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if tag in self._closed_void:
+            self._closed_void.remove(tag)
+        else:
+            self._pop_to(tag)
+
+    def handle_data(self, data):
+        self._data.append(data)
+
+    def handle_charref(self, name):
+        # bs4 BeautifulSoupHTMLParser.handle_charref: code points below 256 are
+        # read as windows-1252 (str input has no original encoding)
+        if name.startswith("x"):
+            code = int(name.lstrip("x"), 16)
+        elif name.startswith("X"):
+            code = int(name.lstrip("X"), 16)
+        else:
+            code = int(name)
+        data = None
+        if code < 256:
+            try:
+                data = bytearray([code]).decode("windows-1252")
+            except UnicodeDecodeError:
+                pass
+        if not data:
+            try:
+                data = chr(code)
+            except (ValueError, OverflowError):
+                pass
+        self._data.append(data or "\N{REPLACEMENT CHARACTER}")
+
+    def handle_entityref(self, name):
+        # unknown names stay literal ("&window"), as in bs4
+        character = EntitySubstitution.HTML_ENTITY_TO_CHARACTER.get(name)
+        self._data.append(character if character is not None else "&%s" % name)
+
+    def handle_comment(self, data):
+        self._flush_data()
+
+    def handle_decl(self, decl):
+        self._flush_data()
+
+    def handle_pi(self, data):
+        self._flush_data()
+
+    def unknown_decl(self, data):
+        # a CDATA section is its own string and counts toward get_text()
+        self._flush_data()
+        if data.upper().startswith("CDATA["):
+            self._data.append(data[len("CDATA["):])
+            self._flush_data()
+
+    def close(self):
+        super().close()
+        self._flush_data()
+        self._open = []
+        self._open_kinds.clear()
+
+
+def _html_stats(supp: str) -> _TagStatsParser:
+    # Substring prefilters: no "<" means no tags at all, and no "style" means
+    # no style attribute, so both scans can be skipped outright.
+    parser = _TagStatsParser(check_style="style" in supp)
+    if "<" not in supp:
+        return parser
+    parser.feed(supp)
+    parser.close()
+    return parser
+
+
+def extract_features_from_input(input_data: PredictionInput) -> np.ndarray:
     if artifacts is None:
         raise RuntimeError("Artifacts not loaded")
 
-    html = str(input_data.affected_html_elements).lower()
-    supp = str(input_data.supplementary_information).lower()
-    v_name = str(input_data.violation_name).lower()
-    _wcag = str(input_data.wcag_reference).upper()
-    _url = str(input_data.web_URL)
-    _domain = str(input_data.domain_category).lower().strip()
+    # The snippet checks only look for ASCII markup, so lowercase the encoded
+    # bytes (cheap C-level ASCII lower) rather than the unicode string.
+    html = input_data.affected_html_elements
+    html_b = html.encode("utf-8", "ignore").lower()
+    supp = input_data.supplementary_information.lower()
+    v_name = input_data.violation_name.lower()
 
-    tag_match = re.search(r"<([a-zA-Z0-9]+)", html)
-    tag = tag_match.group(1) if tag_match else "unknown"
+    tag_match = _TAG_START_RE.search(html_b)
+    tag = tag_match.group(1).decode("ascii") if tag_match else "unknown"
 
-    cr_match = re.search(r"contrastratio':\s*([0-9.]+)", supp)
-    fs_match = re.search(r"fontsize':\s*['\"]([0-9.]+)", supp)
+    cr_match = _CONTRAST_RE.search(supp)
+    fs_match = _FONT_SIZE_RE.search(supp)
 
-    soup = BeautifulSoup(str(supp), "html.parser")
+    stats = _html_stats(supp)
+    counts = stats.counts
 
     features = {
         "tag_enc": _encode_tag(tag),
         "snippet_len": len(html),
         "word_count": len(html.split()),
-        "tag_count": html.count("<"),
-        "is_button_or_link": 1 if any(x in html for x in ["<a", "<button"]) else 0,
-        "is_img_or_svg": 1 if any(x in html for x in ["<img", "<svg"]) else 0,
-        "has_alt_attr": 1 if "alt=" in html else 0,
-        "has_aria_label": 1 if "aria-label=" in html else 0,
-        "has_role_attr": 1 if "role=" in html else 0,
+        "tag_count": html_b.count(b"<"),
+        "is_button_or_link": 1 if (b"<a" in html_b or b"<button" in html_b) else 0,
+        "is_img_or_svg": 1 if (b"<img" in html_b or b"<svg" in html_b) else 0,
+        "has_alt_attr": 1 if b"alt=" in html_b else 0,
+        "has_aria_label": 1 if b"aria-label=" in html_b else 0,
+        "has_role_attr": 1 if b"role=" in html_b else 0,
         "is_aria_related": 1 if ("aria" in v_name or "aria" in supp) else 0,
         "contrast_ratio": float(cr_match.group(1)) if cr_match else 0.0,
         "font_size": float(fs_match.group(1)) if fs_match else 0.0,
-        "num_links": len(soup.find_all("a")),
-        "num_images": len(soup.find_all(["img", "svg"])),
-        "num_buttons": len(soup.find_all("button")),
-        "num_inputs": len(soup.find_all("input")),
-        "num_lists": len(soup.find_all(["ul", "ol", "li"])),
-        "num_headings": len(soup.find_all(["h1", "h2", "h3", "h4", "h5", "h6"])),
-        "has_form": int(soup.find("form") is not None),
-        "num_divs": len(soup.find_all("div")),
-        "num_spans": len(soup.find_all("span")),
-        "avg_text_len_per_tag": float(np.mean([len(t.get_text()) for t in soup.find_all()])) if soup.find_all() else 0.0,
-        "has_inline_style": int(soup.find(attrs={"style": True}) is not None),
-        "has_script_or_style": int(soup.find(["script", "style"]) is not None),
+        "num_links": counts["num_links"],
+        "num_images": counts["num_images"],
+        "num_buttons": counts["num_buttons"],
+        "num_inputs": counts["num_inputs"],
+        "num_lists": counts["num_lists"],
+        "num_headings": counts["num_headings"],
+        "has_form": int(counts["has_form"] > 0),
+        "num_divs": counts["num_divs"],
+        "num_spans": counts["num_spans"],
+        "avg_text_len_per_tag": stats.total_text_len / stats.tag_count if stats.tag_count else 0.0,
+        "has_inline_style": int(stats.has_inline_style),
+        "has_script_or_style": int(counts["has_script_or_style"] > 0),
     }
 
-    df = pd.DataFrame([features])
+    # (1, n_features) row in training column order; missing features stay 0
+    X = np.zeros((1, len(feature_names)), dtype=np.float32)
+    for feat, value in features.items():
+        idx = feature_index.get(feat)
+        if idx is not None:
+            X[0, idx] = value
 
-    # ensure training features exist and in correct order
-    for feat in artifacts["feature_names"]:
-        if feat not in df.columns:
-            df[feat] = 0
+    return X
 
-    return df[artifacts["feature_names"]]
 
+# SHAP contributions keyed by the (rounded) feature row; the same violation
+# patterns recur across pages.
+SHAP_CACHE_SIZE = int(os.getenv("SHAP_CACHE_SIZE", "4096"))
+_shap_cache: "OrderedDict[bytes, np.ndarray]" = OrderedDict()
 
-def _to_dmatrix(X: pd.DataFrame) -> xgb.DMatrix:
-    return xgb.DMatrix(X, feature_names=list(X.columns))
 
-
-def _slice_multiclass_shap(shap_vals, pred_class: int, n_classes: int) -> np.ndarray:
+def _shap_contributions(X: np.ndarray) -> np.ndarray:
     """
-    SHAP multiclass outputs vary by version:
-      - list of length K with arrays (n_samples, n_features)
-      - ndarray (n_samples, n_features, K)
-      - ndarray (n_samples, K, n_features)
-      - ndarray (K, n_samples, n_features)
-    Return 1D array (n_features,) for the predicted class.
+    Per-class SHAP values for a single row, computed natively by XGBoost
+    (pred_contribs). Returns (K, n_features + 1); the last column is the
+    base value (bias) for each class.
     """
-    if isinstance(shap_vals, list):
-        # list[K] -> (n_samples, n_features)
-        return np.asarray(shap_vals[pred_class][0]).reshape(-1)
-
-    S = np.asarray(shap_vals)
+    key = np.round(X, 4).astype(np.float32).tobytes()
+    contribs = _shap_cache.get(key)
+    if contribs is not None:
+        _shap_cache.move_to_end(key)
+        return contribs
+
+    dm = xgb.DMatrix(X, feature_names=feature_names)
+    # strict_shape pins the layout to (rows, groups, features + 1) regardless
+    # of objective, so callers can index it directly.
+    contribs = model.predict(dm, pred_contribs=True, strict_shape=True)[0]
+    assert contribs.shape == (len(class_scores), len(feature_names) + 1), contribs.shape
+    _shap_cache[key] = contribs
+    if len(_shap_cache) > SHAP_CACHE_SIZE:
+        _shap_cache.popitem(last=False)
+    return contribs
 
-    if S.ndim != 3:
-        raise ValueError(f"Unexpected SHAP ndim={S.ndim}, shape={S.shape}")
 
-    if S.shape[-1] == n_classes:
-        # (n_samples, n_features, K)
-        return S[0, :, pred_class].reshape(-1)
-    if S.shape[1] == n_classes:
-        # (n_samples, K, n_features)
-        return S[0, pred_class, :].reshape(-1)
-    if S.shape[0] == n_classes:
-        # (K, n_samples, n_features)
-        return S[pred_class, 0, :].reshape(-1)
+# -----------------------------
+# Micro-batching
+# -----------------------------
+PREDICT_BATCH_SIZE = int(os.getenv("PREDICT_BATCH_SIZE", "64"))
+PREDICT_BATCH_WAIT_MS = float(os.getenv("PREDICT_BATCH_WAIT_MS", "5"))
 
-    raise ValueError(f"3D SHAP array but no axis matches n_classes={n_classes}. shape={S.shape}")
 
+class PredictBatcher:
+    """
+    Collects concurrent single-row predictions for up to `max_wait_ms` (or
+    `max_batch` rows), runs them through one inplace_predict call and hands
+    each caller back its own probability row.
+    """
 
-def _get_base_value_for_class(expl: shap.TreeExplainer, pred_class: int) -> float:
-    ev = np.asarray(expl.expected_value).reshape(-1)
-    if ev.size == 1:
-        return float(ev[0])
-    return float(ev[pred_class])
+    def __init__(self, max_batch: int, max_wait_ms: float):
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue: asyncio.Queue | None = None
+        self._task: asyncio.Task | None = None
+        self._buf: np.ndarray | None = None
+
+    def start(self):
+        self._queue = asyncio.Queue()
+        self._buf = np.zeros((self.max_batch, len(feature_names)), dtype=np.float32)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def predict(self, X: np.ndarray) -> np.ndarray:
+        """Return the (K,) class probabilities for a (1, n_features) row."""
+        if self._task is None:
+            raise RuntimeError("Prediction batcher not started")
+        fut = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((X, fut))
+        return await fut
+
+    async def _collect(self) -> list:
+        loop = asyncio.get_running_loop()
+        items = [await self._queue.get()]
+        deadline = loop.time() + self.max_wait
+        while len(items) < self.max_batch:
+            if not self._queue.empty():
+                items.append(self._queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                items.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return items
+
+    def _fill_batch(self, items: list) -> np.ndarray:
+        """Copy the queued rows into the reusable batch matrix and return its view."""
+        width = items[0][0].shape[1]
+        if self._buf is None or self._buf.shape[1] != width:
+            self._buf = np.zeros((self.max_batch, width), dtype=np.float32)
+        batch = self._buf[: len(items)]
+        for i, (x, _) in enumerate(items):
+            batch[i] = x[0]
+        return batch
+
+    async def _run(self):
+        while True:
+            items = await self._collect()
+            try:
+                probs = _predict_proba(self._fill_batch(items))
+            except Exception as e:
+                for _, fut in items:
+                    if not fut.done():
+                        fut.set_exception(e)
+                continue
+            for row, (_, fut) in zip(probs, items):
+                if not fut.done():
+                    fut.set_result(row)
+
+
+batcher = PredictBatcher(PREDICT_BATCH_SIZE, PREDICT_BATCH_WAIT_MS)
 
 
 # -----------------------------
 # Model loading
 # -----------------------------
+def _predict_proba(X: np.ndarray) -> np.ndarray:
+    """(N, K) class probabilities, from the Treelite library when one is loaded."""
+    if tl_predictor is not None:
+        probs = tl_predictor.predict(treelite_runtime.DMatrix(X, dtype="float32"))
+    else:
+        probs = model.inplace_predict(X)
+    return np.asarray(probs).reshape(X.shape[0], -1)
+
+
+def _load_treelite(model_path: str):
+    """Load the compiled model next to model_path if it is present and not stale."""
+    lib_path = os.path.splitext(model_path)[0] + ".so"
+    if treelite_runtime is None or not os.path.exists(lib_path):
+        return None
+    if os.path.getmtime(lib_path) < os.path.getmtime(model_path):
+        print(f"⚠️ Ignoring stale Treelite library {lib_path}")
+        return None
+    try:
+        predictor = treelite_runtime.Predictor(lib_path, nthread=1)
+    except Exception as e:
+        print(f"⚠️ Could not load Treelite library, using XGBoost: {e}")
+        return None
+    print(f"✅ Treelite predictor loaded from {lib_path}")
+    return predictor
+
+
 def load_model() -> bool:
-    global model, artifacts, explainer
+    global model, artifacts, feature_names, feature_index, class_scores, tl_predictor
 
     try:
         # model_path = os.path.join("models", "xgb_model.json")
@@ -208,66 +499,33 @@ def load_model() -> bool:
 
         model = xgb.Booster()
         model.load_model(model_path)
+        model.set_param({"nthread": 1, "predictor": "cpu_predictor"})
+        tl_predictor = _load_treelite(model_path)
 
         with open(art_path, "rb") as f:
             artifacts = pickle.load(f)
 
-        # Build a tiny background dataset so SHAP init is stable for Booster multiclass
-        bg = pd.DataFrame(
-            [np.zeros(len(artifacts["feature_names"]))],
-            columns=artifacts["feature_names"],
-        )
-
-        print("Initializing SHAP explainer...")
-        # explainer = shap.TreeExplainer(
-        #     model,
-        #     data=bg,
-        #     feature_perturbation="tree_path_dependent",
-        # )
-
-        # Build a larger background dataset so it covers enough leaves
-        # (TreeExplainer needs this for multiclass + Booster)
-        bg_rows = []
-        dummy = PredictionInput(
-            affected_html_elements='<img src="x.png" alt="logo">',
-            supplementary_information='<div><a href="#">link</a><button>ok</button><img src="x.png"></div>',
-            violation_name="missing alt text",
-            wcag_reference="WCAG 1.1.1 (A)",
-            web_URL="https://example.com",
-            domain_category="education",
-        )
-
-        # create variation to cover more splits
-        for tag in ["img", "a", "button", "input", "div", "svg", "span", "h1"]:
-            dummy.affected_html_elements = f'<{tag} aria-label="x" role="x" style="color:#aaa">test</{tag}>'
-            dummy.supplementary_information = (
-                f"<div><{tag} aria-label='x'>hello</{tag}>"
-                f"<a href='#'>a</a><button>btn</button><input type='text'/>"
-                f"<ul><li>one</li></ul><h1>H</h1></div>"
-                f" contrastratio': {np.random.uniform(1, 21):.2f}, fontsize': '{np.random.uniform(10, 24):.1f}"
-            )
-            bg_rows.append(extract_features_from_input(dummy))
-
-        bg = pd.concat(bg_rows, ignore_index=True)
-
-        # Use interventional (works when background doesn't cover all leaves)
-        explainer = shap.TreeExplainer(
-            model,
-            data=bg,
-            feature_perturbation="interventional"
+        _shap_cache.clear()
+        feature_names = tuple(artifacts["feature_names"])
+        feature_index = {name: i for i, name in enumerate(feature_names)}
+        reverse_mapping = artifacts["reverse_mapping"]
+        class_scores = np.array(
+            [reverse_mapping[i] for i in range(len(reverse_mapping))], dtype=np.int32
         )
 
-        print("✅ SHAP explainer initialized successfully!")
         print("✅ Model and artifacts loaded successfully!")
         return True
 
     except Exception as e:
-        print(f"❌ Error loading model/SHAP: {e}")
+        print(f"❌ Error loading model: {e}")
         import traceback
         traceback.print_exc()
         model = None
+        tl_predictor = None
         artifacts = None
-        explainer = None
+        feature_names = ()
+        feature_index = {}
+        class_scores = np.empty(0, dtype=np.int32)
         return False
 
 
@@ -275,7 +533,13 @@ def load_model() -> bool:
 async def startup_event():
     ok = load_model()
     if not ok:
-        print("⚠️  WARNING: Model/SHAP not loaded. Check models/ paths and versions.")
+        print("⚠️  WARNING: Model not loaded. Check models/ paths and versions.")
+    batcher.start()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await batcher.stop()
 
 
 # -----------------------------
@@ -288,7 +552,7 @@ async def root():
         "status": "running",
         "model_loaded": model is not None,
         "artifacts_loaded": artifacts is not None,
-        "explainer_ready": explainer is not None,
+        "explainer_ready": model is not None,
         "endpoints": {
             "predict": "/predict",
             "shap": "/shap",
@@ -304,36 +568,59 @@ async def health_check():
         "status": "healthy",
         "model_loaded": model is not None,
         "artifacts_loaded": artifacts is not None,
-        "explainer_ready": explainer is not None,
+        "explainer_ready": model is not None,
     }
 
 
-@app.post("/predict", response_model=PredictionOutput)
-async def predict(input_data: PredictionInput):
-    if model is None or artifacts is None:
-        raise HTTPException(status_code=503, detail="Model not loaded")
+async def _predict_core(input_data: PredictionInput):
+    """Extract features once and predict; returns (X, probs, y_pred_class)."""
+    X = extract_features_from_input(input_data)
+    probs = await batcher.predict(X)  # (K,)
+    return X, probs, int(np.argmax(probs))
 
-    try:
-        X = extract_features_from_input(input_data)
-        dm = _to_dmatrix(X)
 
-        probs = model.predict(dm)[0]  # (K,)
-        probs = np.asarray(probs).reshape(-1)
+def _build_prediction(probs: np.ndarray, y_pred_class: int) -> PredictionOutput:
+    all_probabilities = dict(zip(class_scores.tolist(), probs.tolist()))
 
-        y_pred_class = int(np.argmax(probs))
+    return PredictionOutput(
+        predicted_score=int(class_scores[y_pred_class]),
+        prediction_probability=float(probs[y_pred_class]),
+        all_probabilities=all_probabilities,
+    )
 
-        reverse_mapping = artifacts["reverse_mapping"]
-        predicted_score = reverse_mapping[y_pred_class]
 
-        all_probabilities = {
-            reverse_mapping[i]: float(probs[i]) for i in range(len(probs))
-        }
+def _build_explanation(X: np.ndarray, y_pred_class: int) -> SHAPOutput:
+    predicted_score = int(class_scores[y_pred_class])
 
-        return PredictionOutput(
-            predicted_score=int(predicted_score),
-            prediction_probability=float(probs[y_pred_class]),
-            all_probabilities=all_probabilities,
-        )
+    # Compute SHAP values: (K, n_features + 1), last column is the bias
+    contribs = _shap_contributions(X)
+    shap_array = contribs[y_pred_class, :-1]
+    base_value = contribs[y_pred_class, -1]
+
+    shap_dict = {f: float(v) for f, v in zip(feature_names, shap_array)}
+
+    top_features = sorted(
+        [{"feature": k, "shap_value": v} for k, v in shap_dict.items()],
+        key=lambda x: abs(x["shap_value"]),
+        reverse=True,
+    )[:10]
+
+    return SHAPOutput(
+        predicted_score=predicted_score,
+        shap_values=shap_dict,
+        top_features=top_features,
+        base_value=float(base_value),
+    )
+
+
+@app.post("/predict", response_model=PredictionOutput)
+async def predict(input_data: PredictionInput):
+    if model is None or artifacts is None:
+        raise HTTPException(status_code=503, detail="Model not loaded")
+
+    try:
+        _, probs, y_pred_class = await _predict_core(input_data)
+        return _build_prediction(probs, y_pred_class)
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Prediction error: {str(e)}")
@@ -343,43 +630,10 @@ async def predict(input_data: PredictionInput):
 async def get_shap_values(input_data: PredictionInput):
     if model is None or artifacts is None:
         raise HTTPException(status_code=503, detail="Model not loaded")
-    if explainer is None:
-        raise HTTPException(status_code=503, detail="SHAP explainer not initialized (startup failed)")
 
     try:
-        X = extract_features_from_input(input_data)
-
-        # Predict class (Booster needs DMatrix)
-        dm = _to_dmatrix(X)
-        probs = np.asarray(model.predict(dm)[0]).reshape(-1)
-        y_pred_class = int(np.argmax(probs))
-
-        reverse_mapping = artifacts["reverse_mapping"]
-        predicted_score = int(reverse_mapping[y_pred_class])
-
-        # Compute SHAP values
-        shap_vals = explainer.shap_values(X)
-
-        # K classes
-        n_classes = len(reverse_mapping)  # should be 4
-        shap_array = _slice_multiclass_shap(shap_vals, y_pred_class, n_classes)
-        base_value = _get_base_value_for_class(explainer, y_pred_class)
-
-        feature_names = artifacts["feature_names"]
-        shap_dict = {f: float(v) for f, v in zip(feature_names, shap_array)}
-
-        top_features = sorted(
-            [{"feature": k, "shap_value": v} for k, v in shap_dict.items()],
-            key=lambda x: abs(x["shap_value"]),
-            reverse=True,
-        )[:10]
-
-        return SHAPOutput(
-            predicted_score=predicted_score,
-            shap_values=shap_dict,
-            top_features=top_features,
-            base_value=float(base_value),
-        )
+        X, _, y_pred_class = await _predict_core(input_data)
+        return _build_explanation(X, y_pred_class)
 
     except Exception as e:
         import traceback
@@ -391,22 +645,43 @@ async def get_shap_values(input_data: PredictionInput):
 async def predict_with_shap(input_data: PredictionInput):
     if model is None or artifacts is None:
         raise HTTPException(status_code=503, detail="Model not loaded")
-    if explainer is None:
-        raise HTTPException(status_code=503, detail="SHAP explainer not initialized (startup failed)")
 
-    prediction = await predict(input_data)
-    shap_output = await get_shap_values(input_data)
+    # Features and class are computed once and shared by both halves
+    try:
+        X, probs, y_pred_class = await _predict_core(input_data)
+        prediction = _build_prediction(probs, y_pred_class)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Prediction error: {str(e)}")
+
+    try:
+        shap_output = _build_explanation(X, y_pred_class)
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=f"SHAP calculation error: {str(e)}")
 
     return {
-        "prediction": prediction.dict(),
-        "explanation": shap_output.dict(),
+        "prediction": prediction.model_dump(),
+        "explanation": shap_output.model_dump(),
     }
 
 
 if __name__ == "__main__":
     import uvicorn
 
-    print("AccessGuru ML API starting on http://0.0.0.0:8000")
+    # One single-threaded process per core scales the CPU-bound predict;
+    # "auto" picks uvloop / httptools when installed (uvicorn[standard]).
+    workers = int(os.getenv("WORKERS", str(os.cpu_count() or 1)))
+
+    print(f"AccessGuru ML API starting on http://0.0.0.0:8000 ({workers} workers)")
     print("   API docs: http://localhost:8000/docs")
     print("   Health check: http://localhost:8000/health")
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    uvicorn.run(
+        "app:app",
+        app_dir=os.path.dirname(os.path.abspath(__file__)),
+        host="0.0.0.0",
+        port=8000,
+        workers=workers,
+        loop="auto",
+        http="auto",
+    )
@@ -1,20 +1,35 @@
 import os
-import json
-from typing import Dict, List, Optional, Any
+import asyncio
+import heapq
+import time
+import hashlib
+import orjson
+import httpx
+from collections import Counter, OrderedDict
+from dataclasses import dataclass
+from typing import Dict, List, Literal, Optional, Tuple, Any
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field
-from openai import OpenAI
+from pydantic import BaseModel, Field, TypeAdapter, ValidationError
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
 from dotenv import load_dotenv
 import uvicorn
-from fastapi.responses import StreamingResponse, HTMLResponse
+from fastapi.responses import StreamingResponse, HTMLResponse, ORJSONResponse
 from jinja2 import Environment, BaseLoader
 import io
-from datetime import datetime
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+
+try:
+    import h2  # noqa: F401  (HTTP/2 support for httpx, from httpx[http2])
+    _HTTP2 = True
+except ImportError:
+    _HTTP2 = False
 
 load_dotenv()
 
-app = FastAPI(title="AccessGuru LLM Server")
+app = FastAPI(title="AccessGuru LLM Server", default_response_class=ORJSONResponse)
 
 # CORS configuration
 app.add_middleware(
@@ -33,7 +48,60 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 if not OPENAI_API_KEY:
     raise RuntimeError("❌ Missing OPENAI_API_KEY in environment variables")
 
-openai_client = OpenAI(api_key=OPENAI_API_KEY)
+# Created per worker process in the startup hook: the client owns an httpx
+# connection pool that must not be shared across forked workers.
+openai_client: Optional[AsyncOpenAI] = None
+
+# Upper bound on concurrent OpenAI requests (batch endpoints fan out)
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "20"))
+# Seconds to wait on OpenAI reads; a full report (2000 tokens) arrives in one
+# response, so this must exceed its generation time
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+llm_semaphore = asyncio.Semaphore(LLM_CONCURRENCY)
+
+# Server processes started by __main__ (one per CPU core by default)
+WORKERS = int(os.getenv("WORKERS", str(os.cpu_count() or 4)))
+
+# WeasyPrint layout is CPU-bound and holds the GIL, so PDFs are rendered in a
+# process pool (created in the startup hook) rather than on the event loop.
+# Every server worker owns a pool, so the default splits the cores between
+# them instead of giving each worker cpu_count renderers.
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", str(max(1, (os.cpu_count() or 4) // WORKERS))))
+_pdf_pool: Optional[ProcessPoolExecutor] = None
+
+# In-process cache of validated LLM responses. axe-core reports the same
+# violations (e.g. html-has-lang) verbatim across pages, so exact repeats
+# skip the OpenAI round-trip entirely.
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", "10000"))
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", "86400"))
+_llm_cache: "OrderedDict[str, tuple]" = OrderedDict()
+
+
+def _cache_key(*parts: Any) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        h.update(str(part).encode("utf-8"))
+        h.update(b"\x00")
+    return h.hexdigest()
+
+
+def _cache_get(key: str) -> Optional[Dict[str, Any]]:
+    entry = _llm_cache.get(key)
+    if entry is None:
+        return None
+    expires_at, value = entry
+    if expires_at < time.monotonic():
+        del _llm_cache[key]
+        return None
+    _llm_cache.move_to_end(key)
+    return value
+
+
+def _cache_set(key: str, value: Dict[str, Any]) -> None:
+    _llm_cache[key] = (time.monotonic() + LLM_CACHE_TTL, value)
+    _llm_cache.move_to_end(key)
+    if len(_llm_cache) > LLM_CACHE_SIZE:
+        _llm_cache.popitem(last=False)
 
 # Required JSON keys for response
 REQUIRED_KEYS = [
@@ -43,6 +111,11 @@ REQUIRED_KEYS = [
     "4_what_to_fix",
     "5_how_to_fix"
 ]
+_REQUIRED_KEY_SET = frozenset(REQUIRED_KEYS)
+
+# Required JSON keys for severity explanations
+SEVERITY_REQUIRED_KEYS = ["severity_explanation", "key_factors", "confidence_note"]
+_SEVERITY_KEY_SET = frozenset(SEVERITY_REQUIRED_KEYS)
 
 
 # Pydantic models
@@ -134,176 +207,281 @@ class ReportRequest(BaseModel):
     issues: List[ReportIssue]
 
 
+# Shape of the report the LLM writes for /api/generate_report: an overview plus
+# one section per issue, each from its own call. Sent to OpenAI as strict JSON
+# schemas, so every field is required and no extras are allowed.
+class SeverityCountsJson(BaseModel):
+    severity_2: int = Field(..., alias="2")
+    severity_3: int = Field(..., alias="3")
+    severity_4: int = Field(..., alias="4")
+    severity_5: int = Field(..., alias="5")
+
+    class Config:
+        extra = "forbid"
+
+
+class ReportStatsJson(BaseModel):
+    total_issues: int
+    by_severity: SeverityCountsJson
+
+    class Config:
+        extra = "forbid"
+
+
+class RecommendationJson(BaseModel):
+    priority: Literal["P0", "P1", "P2"]
+    recommendation: str
+    rationale: str
+
+    class Config:
+        extra = "forbid"
+
+
+class IssueSectionJson(BaseModel):
+    violation_id: str
+    severity_level: int
+    severity_name: str
+    summary: str
+    impact_on_users: str
+    recommended_fix: str
+    developer_notes: str
+
+    class Config:
+        extra = "forbid"
+
+
+class ReportOverviewJson(BaseModel):
+    title: str
+    executive_summary: str
+    overall_risk: Literal["Low", "Medium", "High", "Critical"]
+    highlights: List[str]
+    stats: ReportStatsJson
+    prioritized_recommendations: List[RecommendationJson]
+    next_steps: List[str]
+
+    class Config:
+        extra = "forbid"
+
+
+class IssueSectionsJson(BaseModel):
+    issue_sections: List[IssueSectionJson]
+
+    class Config:
+        extra = "forbid"
+
+
+class ReportJson(ReportOverviewJson):
+    issue_sections: List[IssueSectionJson]
+
+
+# Report payloads are assembled by the extension from /api/llm_reasons and
+# /api/explain_severity output that was validated once already. With
+# TRUST_INTERNAL_PAYLOADS=1 they are built without re-validation.
+TRUST_INTERNAL_PAYLOADS = os.getenv("TRUST_INTERNAL_PAYLOADS", "0") == "1"
+
+
+def parse_report_request(raw: bytes) -> ReportRequest:
+    if not TRUST_INTERNAL_PAYLOADS:
+        return ReportRequest.model_validate_json(raw)
+
+    # model_construct does not recurse, so build the nested models explicitly
+    body = orjson.loads(raw)
+    issues = [
+        ReportIssue.model_construct(**{
+            **issue,
+            "fix": IssueFixJson.model_construct(**issue["fix"]),
+            "severity": IssueSeverityJson.model_construct(**issue["severity"]),
+        })
+        for issue in body["issues"]
+    ]
+    return ReportRequest.model_construct(**{**body, "issues": issues})
+
+
+@dataclass(frozen=True, slots=True)
+class Rule:
+    description: str
+    impact: str
+    wcag: Tuple[str, ...]
+    category: str
+
+
+@dataclass(frozen=True, slots=True)
+class Severity:
+    name: str
+    description: str
+    color: str
+
+
 # Accessibility rules database (parsed from markdown)
-ACCESSIBILITY_RULES = {
-    "area-alt": {
-        "description": "Ensure <area> elements of image maps have alternative text",
-        "impact": "Critical",
-        "wcag": ["2.4.4", "4.1.2"],
-        "category": "Text Alternatives"
-    },
-    "aria-allowed-attr": {
-        "description": "Ensure an element's role supports its ARIA attributes",
-        "impact": "Critical",
-        "wcag": ["4.1.2"],
-        "category": "ARIA"
-    },
-    "aria-command-name": {
-        "description": "Ensure every ARIA button, link and menuitem has an accessible name",
-        "impact": "Serious",
-        "wcag": ["4.1.2"],
-        "category": "ARIA"
-    },
-    "aria-hidden-body": {
-        "description": "Ensure aria-hidden='true' is not present on the document body",
-        "impact": "Critical",
-        "wcag": ["1.3.1", "4.1.2"],
-        "category": "ARIA"
-    },
-    "button-name": {
-        "description": "Ensure buttons have discernible text",
-        "impact": "Critical",
-        "wcag": ["4.1.2"],
-        "category": "Forms"
-    },
-    "color-contrast": {
-        "description": "Ensure the contrast between foreground and background colors meets WCAG requirements",
-        "impact": "Serious",
-        "wcag": ["1.4.3"],
-        "category": "Color"
-    },
-    "document-title": {
-        "description": "Ensure each HTML document contains a non-empty <title> element",
-        "impact": "Serious",
-        "wcag": ["2.4.2"],
-        "category": "Semantics"
-    },
-    "duplicate-id-aria": {
-        "description": "Ensure every id attribute value used in ARIA and in labels is unique",
-        "impact": "Critical",
-        "wcag": ["4.1.1"],
-        "category": "Parsing"
-    },
-    "form-field-multiple-labels": {
-        "description": "Ensure form field does not have multiple label elements",
-        "impact": "Moderate",
-        "wcag": ["3.3.2"],
-        "category": "Forms"
-    },
-    "frame-title": {
-        "description": "Ensure <iframe> and <frame> elements have a unique and non-empty title attribute",
-        "impact": "Serious",
-        "wcag": ["4.1.2"],
-        "category": "Semantics"
-    },
-    "html-has-lang": {
-        "description": "Ensure every HTML document has a lang attribute",
-        "impact": "Serious",
-        "wcag": ["3.1.1"],
-        "category": "Language"
-    },
-    "html-lang-valid": {
-        "description": "Ensure the lang attribute of the <html> element has a valid value",
-        "impact": "Serious",
-        "wcag": ["3.1.1"],
-        "category": "Language"
-    },
-    "image-alt": {
-        "description": "Ensure <img> elements have alternate text or a role of none or presentation",
-        "impact": "Critical",
-        "wcag": ["1.1.1"],
-        "category": "Text Alternatives"
-    },
-    "input-button-name": {
-        "description": "Ensure input buttons have discernible text",
-        "impact": "Critical",
-        "wcag": ["4.1.2"],
-        "category": "Forms"
-    },
-    "input-image-alt": {
-        "description": "Ensure <input type='image'> elements have alternate text",
-        "impact": "Critical",
-        "wcag": ["1.1.1", "4.1.2"],
-        "category": "Forms"
-    },
-    "label": {
-        "description": "Ensure every form element has a label",
-        "impact": "Critical",
-        "wcag": ["1.3.1", "4.1.2"],
-        "category": "Forms"
-    },
-    "link-name": {
-        "description": "Ensure links have discernible text",
-        "impact": "Serious",
-        "wcag": ["4.1.2", "2.4.4"],
-        "category": "Semantics"
-    },
-    "list": {
-        "description": "Ensure that lists are structured correctly",
-        "impact": "Serious",
-        "wcag": ["1.3.1"],
-        "category": "Semantics"
-    },
-    "listitem": {
-        "description": "Ensure <li> elements are used semantically",
-        "impact": "Serious",
-        "wcag": ["1.3.1"],
-        "category": "Semantics"
-    },
-    "meta-viewport": {
-        "description": "Ensure <meta name='viewport'> does not disable text scaling and zooming",
-        "impact": "Critical",
-        "wcag": ["1.4.4"],
-        "category": "Zoom"
-    },
-    "heading-order": {
-        "description": "Ensure the order of headings is semantically correct",
-        "impact": "Moderate",
-        "wcag": ["1.3.1"],
-        "category": "Semantics"
-    },
-    "page-has-heading-one": {
-        "description": "Ensure the page has at least one <h1>",
-        "impact": "Moderate",
-        "wcag": ["1.3.1"],
-        "category": "Semantics"
-    },
-    "role-img-alt": {
-        "description": "Ensure [role='img'] elements have alternate text",
-        "impact": "Serious",
-        "wcag": ["1.1.1"],
-        "category": "ARIA"
-    },
-    "scrollable-region-focusable": {
-        "description": "Ensure scrollable region has keyboard access",
-        "impact": "Serious",
-        "wcag": ["2.1.1"],
-        "category": "Keyboard"
-    },
-    "select-name": {
-        "description": "Ensure select element has an accessible name",
-        "impact": "Critical",
-        "wcag": ["4.1.2"],
-        "category": "Forms"
-    },
-    "svg-img-alt": {
-        "description": "Ensure <svg> elements with an img role have an alternative text",
-        "impact": "Serious",
-        "wcag": ["1.1.1"],
-        "category": "Text Alternatives"
-    },
-    "valid-lang": {
-        "description": "Ensure lang attributes have valid values",
-        "impact": "Serious",
-        "wcag": ["3.1.2"],
-        "category": "Language"
-    },
-    "video-caption": {
-        "description": "Ensure <video> elements have captions",
-        "impact": "Critical",
-        "wcag": ["1.2.2"],
-        "category": "Media"
-    }
+ACCESSIBILITY_RULES: Dict[str, Rule] = {
+    "area-alt": Rule(
+        description="Ensure <area> elements of image maps have alternative text",
+        impact="Critical",
+        wcag=("2.4.4", "4.1.2"),
+        category="Text Alternatives",
+    ),
+    "aria-allowed-attr": Rule(
+        description="Ensure an element's role supports its ARIA attributes",
+        impact="Critical",
+        wcag=("4.1.2",),
+        category="ARIA",
+    ),
+    "aria-command-name": Rule(
+        description="Ensure every ARIA button, link and menuitem has an accessible name",
+        impact="Serious",
+        wcag=("4.1.2",),
+        category="ARIA",
+    ),
+    "aria-hidden-body": Rule(
+        description="Ensure aria-hidden='true' is not present on the document body",
+        impact="Critical",
+        wcag=("1.3.1", "4.1.2"),
+        category="ARIA",
+    ),
+    "button-name": Rule(
+        description="Ensure buttons have discernible text",
+        impact="Critical",
+        wcag=("4.1.2",),
+        category="Forms",
+    ),
+    "color-contrast": Rule(
+        description="Ensure the contrast between foreground and background colors meets WCAG requirements",
+        impact="Serious",
+        wcag=("1.4.3",),
+        category="Color",
+    ),
+    "document-title": Rule(
+        description="Ensure each HTML document contains a non-empty <title> element",
+        impact="Serious",
+        wcag=("2.4.2",),
+        category="Semantics",
+    ),
+    "duplicate-id-aria": Rule(
+        description="Ensure every id attribute value used in ARIA and in labels is unique",
+        impact="Critical",
+        wcag=("4.1.1",),
+        category="Parsing",
+    ),
+    "form-field-multiple-labels": Rule(
+        description="Ensure form field does not have multiple label elements",
+        impact="Moderate",
+        wcag=("3.3.2",),
+        category="Forms",
+    ),
+    "frame-title": Rule(
+        description="Ensure <iframe> and <frame> elements have a unique and non-empty title attribute",
+        impact="Serious",
+        wcag=("4.1.2",),
+        category="Semantics",
+    ),
+    "html-has-lang": Rule(
+        description="Ensure every HTML document has a lang attribute",
+        impact="Serious",
+        wcag=("3.1.1",),
+        category="Language",
+    ),
+    "html-lang-valid": Rule(
+        description="Ensure the lang attribute of the <html> element has a valid value",
+        impact="Serious",
+        wcag=("3.1.1",),
+        category="Language",
+    ),
+    "image-alt": Rule(
+        description="Ensure <img> elements have alternate text or a role of none or presentation",
+        impact="Critical",
+        wcag=("1.1.1",),
+        category="Text Alternatives",
+    ),
+    "input-button-name": Rule(
+        description="Ensure input buttons have discernible text",
+        impact="Critical",
+        wcag=("4.1.2",),
+        category="Forms",
+    ),
+    "input-image-alt": Rule(
+        description="Ensure <input type='image'> elements have alternate text",
+        impact="Critical",
+        wcag=("1.1.1", "4.1.2"),
+        category="Forms",
+    ),
+    "label": Rule(
+        description="Ensure every form element has a label",
+        impact="Critical",
+        wcag=("1.3.1", "4.1.2"),
+        category="Forms",
+    ),
+    "link-name": Rule(
+        description="Ensure links have discernible text",
+        impact="Serious",
+        wcag=("4.1.2", "2.4.4"),
+        category="Semantics",
+    ),
+    "list": Rule(
+        description="Ensure that lists are structured correctly",
+        impact="Serious",
+        wcag=("1.3.1",),
+        category="Semantics",
+    ),
+    "listitem": Rule(
+        description="Ensure <li> elements are used semantically",
+        impact="Serious",
+        wcag=("1.3.1",),
+        category="Semantics",
+    ),
+    "meta-viewport": Rule(
+        description="Ensure <meta name='viewport'> does not disable text scaling and zooming",
+        impact="Critical",
+        wcag=("1.4.4",),
+        category="Zoom",
+    ),
+    "heading-order": Rule(
+        description="Ensure the order of headings is semantically correct",
+        impact="Moderate",
+        wcag=("1.3.1",),
+        category="Semantics",
+    ),
+    "page-has-heading-one": Rule(
+        description="Ensure the page has at least one <h1>",
+        impact="Moderate",
+        wcag=("1.3.1",),
+        category="Semantics",
+    ),
+    "role-img-alt": Rule(
+        description="Ensure [role='img'] elements have alternate text",
+        impact="Serious",
+        wcag=("1.1.1",),
+        category="ARIA",
+    ),
+    "scrollable-region-focusable": Rule(
+        description="Ensure scrollable region has keyboard access",
+        impact="Serious",
+        wcag=("2.1.1",),
+        category="Keyboard",
+    ),
+    "select-name": Rule(
+        description="Ensure select element has an accessible name",
+        impact="Critical",
+        wcag=("4.1.2",),
+        category="Forms",
+    ),
+    "svg-img-alt": Rule(
+        description="Ensure <svg> elements with an img role have an alternative text",
+        impact="Serious",
+        wcag=("1.1.1",),
+        category="Text Alternatives",
+    ),
+    "valid-lang": Rule(
+        description="Ensure lang attributes have valid values",
+        impact="Serious",
+        wcag=("3.1.2",),
+        category="Language",
+    ),
+    "video-caption": Rule(
+        description="Ensure <video> elements have captions",
+        impact="Critical",
+        wcag=("1.2.2",),
+        category="Media",
+    ),
 }
 
 
@@ -324,52 +502,52 @@ FEATURE_DESCRIPTIONS = {
 }
 
 # Severity level descriptions
-SEVERITY_LEVELS = {
-    2: {
-        "name": "Minor",
-        "description": "Low-impact issues that may cause minor inconvenience",
-        "color": "yellow"
-    },
-    3: {
-        "name": "Moderate", 
-        "description": "Medium-impact issues that create barriers for some users",
-        "color": "orange"
-    },
-    4: {
-        "name": "Serious",
-        "description": "High-impact issues that significantly impair accessibility",
-        "color": "red"
-    },
-    5: {
-        "name": "Critical",
-        "description": "Severe issues that prevent access for many users",
-        "color": "darkred"
-    }
+SEVERITY_LEVELS: Dict[int, Severity] = {
+    2: Severity("Minor", "Low-impact issues that may cause minor inconvenience", "yellow"),
+    3: Severity("Moderate", "Medium-impact issues that create barriers for some users", "orange"),
+    4: Severity("Serious", "High-impact issues that significantly impair accessibility", "red"),
+    5: Severity("Critical", "Severe issues that prevent access for many users", "darkred"),
 }
 
+# (level, key in severity_probabilities) for each level, in order
+_SEVERITY_PROB_KEYS = tuple((level, str(level)) for level in SEVERITY_LEVELS)
 
-def get_rule_context(violation_id: str) -> str:
-    """Get additional context about a specific accessibility rule."""
-    rule = ACCESSIBILITY_RULES.get(violation_id, {})
-    if not rule:
-        return ""
-    
+
+def _render_rule_context(violation_id: str, rule: Rule) -> str:
     context_parts = [f"Rule: {violation_id}"]
-    if rule.get("description"):
-        context_parts.append(f"Standard Description: {rule['description']}")
-    if rule.get("impact"):
-        context_parts.append(f"Impact Level: {rule['impact']}")
-    if rule.get("wcag"):
-        context_parts.append(f"WCAG Criteria: {', '.join(rule['wcag'])}")
-    if rule.get("category"):
-        context_parts.append(f"Category: {rule['category']}")
+    if rule.description:
+        context_parts.append(f"Standard Description: {rule.description}")
+    if rule.impact:
+        context_parts.append(f"Impact Level: {rule.impact}")
+    if rule.wcag:
+        context_parts.append(f"WCAG Criteria: {', '.join(rule.wcag)}")
+    if rule.category:
+        context_parts.append(f"Category: {rule.category}")
     
     return "\n".join(context_parts)
 
 
-def build_system_prompt() -> str:
-    """Build the system prompt for the LLM."""
-    return """You are an accessibility expert assistant for AccessGuru, a Chrome extension that helps developers create more accessible websites.
+# The rules are static, so render every context block once at import
+_RULE_CONTEXT_CACHE: Dict[str, str] = {
+    vid: _render_rule_context(vid, rule) for vid, rule in ACCESSIBILITY_RULES.items()
+}
+
+
+def get_rule_context(violation_id: str) -> str:
+    """Get additional context about a specific accessibility rule."""
+    return _RULE_CONTEXT_CACHE.get(violation_id, "")
+
+
+# The severity prompt wraps the same context in a header; pre-render that too
+_SEVERITY_RULE_BLOCKS: Dict[str, str] = {
+    vid: f"\nVIOLATION TYPE:\n{context}\n" for vid, context in _RULE_CONTEXT_CACHE.items()
+}
+_EMPTY_SEVERITY_RULE_BLOCK = "\nVIOLATION TYPE:\n\n"
+
+
+# System prompts are fixed strings; keeping them byte-identical also lets
+# OpenAI reuse its prompt cache across requests.
+SYSTEM_PROMPT = """You are an accessibility expert assistant for AccessGuru, a Chrome extension that helps developers create more accessible websites.
 
 Your role is to analyze accessibility violations detected by axe-core and provide clear, actionable guidance that helps developers understand and fix issues quickly.
 
@@ -402,11 +580,11 @@ IMPORTANT:
 - Reference the actual HTML elements, attributes, and values from the snippet
 - When WCAG criteria are provided, briefly mention the relevant guideline
 - If ML reasoning is available, consider it but prioritize standard accessibility best practices"""
+_SYSTEM_MESSAGE = {"role": "system", "content": SYSTEM_PROMPT}
 
 
-def build_severity_system_prompt() -> str:
-    """Build system prompt for severity explanation."""
-    return """You are an AI accessibility expert for AccessGuru. Your role is to explain why a machine learning model assigned a specific severity score to an HTML snippet's accessibility issues.
+# System prompt for severity explanation
+SEVERITY_SYSTEM_PROMPT = """You are an AI accessibility expert for AccessGuru. Your role is to explain why a machine learning model assigned a specific severity score to an HTML snippet's accessibility issues.
 
 You will receive:
 1. An HTML snippet with accessibility problems
@@ -440,6 +618,7 @@ INTERPRETING SHAP VALUES:
 - Negative SHAP value = this feature DECREASES severity  
 - Larger absolute value = stronger influence on prediction
 - Focus on features with |SHAP| > 0.1 for most meaningful insights"""
+_SEVERITY_SYSTEM_MESSAGE = {"role": "system", "content": SEVERITY_SYSTEM_PROMPT}
 
 
 def build_user_prompt(payload: FixRequest) -> str:
@@ -448,28 +627,29 @@ def build_user_prompt(payload: FixRequest) -> str:
     # Get rule-specific context
     rule_context = get_rule_context(payload.violation_id)
     
-    # Build the complete prompt
+    # Build the complete prompt. Static text first and per-page fields last,
+    # so requests share the longest possible prefix for OpenAI prompt caching.
     prompt = f"""ACCESSIBILITY VIOLATION ANALYSIS
 
+TASK:
+Analyze the specific violation below and provide your response as valid JSON following the exact format specified in the system prompt.
+
 {rule_context}
 
 VIOLATION DETAILS:
-- Page URL: {payload.url}
 - Violation ID: {payload.violation_id}
 - Impact Severity: {payload.impact}
 - Help Text: {payload.help}
 - Description: {payload.description}
-- Target Selector: {payload.target}
 - Help URL: {payload.help_url}
 - WCAG Tags: {', '.join(payload.wcag_tags) if payload.wcag_tags else 'None'}
+- Page URL: {payload.url}
+- Target Selector: {payload.target}
 
 HTML SNIPPET:
 ```html
 {payload.html_snippet or 'No HTML snippet provided'}
-```
-
-TASK:
-Analyze this specific violation and provide your response as valid JSON following the exact format specified in the system prompt."""
+```"""
     
     return prompt
 
@@ -478,19 +658,16 @@ def build_severity_user_prompt(payload: SeverityRequest) -> str:
     """Build user prompt for severity explanation."""
     
     # Get severity info
-    severity_info = SEVERITY_LEVELS.get(payload.predicted_severity, {})
-    severity_name = severity_info.get("name", f"Level {payload.predicted_severity}")
+    severity_info = SEVERITY_LEVELS.get(payload.predicted_severity)
+    severity_name = severity_info.name if severity_info else f"Level {payload.predicted_severity}"
+    severity_description = severity_info.description if severity_info else ""
     
-    # Sort SHAP values by absolute value (most influential first)
-    sorted_shap = sorted(
-        payload.shap_values, 
-        key=lambda x: abs(x.value), 
-        reverse=True
-    )
+    # Top 8 SHAP values by absolute value (most influential first)
+    top_shap = heapq.nlargest(8, payload.shap_values, key=lambda x: abs(x.value))
     
     # Format top SHAP values
     shap_explanations = []
-    for shap in sorted_shap[:8]:  # Top 8 features
+    for shap in top_shap:
         feature = shap.feature
         value = shap.value
         feature_val = shap.feature_value
@@ -507,27 +684,33 @@ def build_severity_user_prompt(payload: SeverityRequest) -> str:
     
     shap_text = "\n\n".join(shap_explanations)
     
-    # Format probabilities
-    prob_text = "\n".join([
-        f"  - Severity {level}: {prob*100:.1f}%"
-        for level, prob in sorted(payload.severity_probabilities.items())
-    ])
+    # Format probabilities in severity order (keys are the strings "2".."5")
+    probs = payload.severity_probabilities
+    prob_text = "\n".join(
+        f"  - Severity {level}: {probs.get(key, 0.0)*100:.1f}%"
+        for level, key in _SEVERITY_PROB_KEYS
+    )
     
     # Get rule context if available
     rule_context = ""
     if payload.violation_id:
-        rule_context = f"\nVIOLATION TYPE:\n{get_rule_context(payload.violation_id)}\n"
+        rule_context = _SEVERITY_RULE_BLOCKS.get(payload.violation_id, _EMPTY_SEVERITY_RULE_BLOCK)
     
+    # Static instructions first, request-specific data last (prompt caching)
     prompt = f"""ACCESSIBILITY SEVERITY PREDICTION ANALYSIS
 
-{rule_context}
-HTML SNIPPET:
-```html
-{payload.html_snippet}
-```
+TASK:
+Analyze why the ML model predicted the severity level given below for the HTML snippet at the end.
+Explain in plain language which features most influenced this prediction and why.
+Focus on the top 3-5 most impactful factors from the SHAP analysis.
 
+Remember:
+- Positive SHAP values INCREASE severity (bad for accessibility)
+- Negative SHAP values DECREASE severity (good for accessibility)
+- Explain what these values mean in practical accessibility terms
+{rule_context}
 PREDICTED SEVERITY: {payload.predicted_severity} ({severity_name})
-{severity_info.get('description', '')}
+{severity_description}
 
 PREDICTION PROBABILITIES:
 {prob_text}
@@ -539,15 +722,10 @@ CONTEXT:
 - Page URL: {payload.url or 'Not provided'}
 - Target Element: {payload.target or 'Not provided'}
 
-TASK:
-Analyze why the ML model predicted severity level {payload.predicted_severity} for this HTML snippet.
-Explain in plain language which features most influenced this prediction and why.
-Focus on the top 3-5 most impactful factors from the SHAP analysis.
-
-Remember:
-- Positive SHAP values INCREASE severity (bad for accessibility)
-- Negative SHAP values DECREASE severity (good for accessibility)
-- Explain what these values mean in practical accessibility terms"""
+HTML SNIPPET:
+```html
+{payload.html_snippet}
+```"""
     
     return prompt
 
@@ -557,16 +735,12 @@ def validate_response(obj: Dict[str, Any]) -> Optional[str]:
     if not obj or not isinstance(obj, dict):
         return "Response is not a valid object."
     
-    keys = list(obj.keys())
-    
-    # Check for missing required keys
-    missing = [k for k in REQUIRED_KEYS if k not in obj]
-    if missing:
-        return f"Missing required keys: {', '.join(missing)}"
-    
-    # Check for extra keys
-    extra = [k for k in keys if k not in REQUIRED_KEYS]
-    if extra:
+    # Check for missing / extra keys (one set comparison when the keys match)
+    if obj.keys() != _REQUIRED_KEY_SET:
+        missing = [k for k in REQUIRED_KEYS if k not in obj]
+        if missing:
+            return f"Missing required keys: {', '.join(missing)}"
+        extra = [k for k in obj if k not in _REQUIRED_KEY_SET]
         return f"Extra keys not allowed: {', '.join(extra)}"
     
     # Validate each value
@@ -586,21 +760,15 @@ def validate_response(obj: Dict[str, Any]) -> Optional[str]:
 
 def validate_severity_response(obj: Dict[str, Any]) -> Optional[str]:
     """Validate severity explanation response structure."""
-    required_keys = ["severity_explanation", "key_factors", "confidence_note"]
-    
     if not obj or not isinstance(obj, dict):
         return "Response is not a valid object."
     
-    keys = list(obj.keys())
-    
-    # Check for missing required keys
-    missing = [k for k in required_keys if k not in obj]
-    if missing:
-        return f"Missing required keys: {', '.join(missing)}"
-    
-    # Check for extra keys
-    extra = [k for k in keys if k not in required_keys]
-    if extra:
+    # Check for missing / extra keys (one set comparison when the keys match)
+    if obj.keys() != _SEVERITY_KEY_SET:
+        missing = [k for k in SEVERITY_REQUIRED_KEYS if k not in obj]
+        if missing:
+            return f"Missing required keys: {', '.join(missing)}"
+        extra = [k for k in obj if k not in _SEVERITY_KEY_SET]
         return f"Extra keys not allowed: {', '.join(extra)}"
     
     # Validate severity_explanation
@@ -635,12 +803,173 @@ def validate_severity_response(obj: Dict[str, Any]) -> Optional[str]:
     return None
 
 
+@app.on_event("startup")
+async def startup_event():
+    global openai_client, _pdf_pool
+    # Transport-level retries cover dropped connections before a request is
+    # sent; the OpenAI client retries rate limits / 5xx (with jittered
+    # backoff) itself. HTTP/2 lets concurrent calls share one connection.
+    transport = httpx.AsyncHTTPTransport(
+        retries=2,
+        http2=_HTTP2,
+        limits=httpx.Limits(max_connections=200, max_keepalive_connections=100),
+    )
+    openai_client = AsyncOpenAI(
+        api_key=OPENAI_API_KEY,
+        http_client=DefaultAsyncHttpxClient(transport=transport),
+        max_retries=3,
+        timeout=httpx.Timeout(LLM_TIMEOUT, connect=5.0),
+    )
+    # spawn, not fork: the parent already runs an event loop and threads
+    _pdf_pool = ProcessPoolExecutor(
+        max_workers=PDF_WORKERS,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_pdf_worker,
+    )
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    if openai_client is not None:
+        await openai_client.close()
+    if _pdf_pool is not None:
+        _pdf_pool.shutdown(wait=False, cancel_futures=True)
+    if _chromium is not None:
+        await _drop_chromium(_chromium)
+
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint."""
     return {"ok": True, "model": MODEL}
 
 
+# Canned answers for requests the LLM cannot say anything specific about
+_NO_CONTEXT_FIX = {key: "Not enough context from snippet; check help_url for details." for key in REQUIRED_KEYS}
+_MIN_SHAP_SIGNAL = 0.01
+
+
+def _lacks_context(payload: FixRequest) -> bool:
+    """No snippet and an unknown rule: the model can only answer generically."""
+    return not (payload.html_snippet or "").strip() and payload.violation_id not in ACCESSIBILITY_RULES
+
+
+def _lacks_shap_signal(payload: SeverityRequest) -> bool:
+    """Enough features to name as key factors, but none moved the prediction."""
+    return len(payload.shap_values) >= 3 and all(abs(s.value) < _MIN_SHAP_SIGNAL for s in payload.shap_values)
+
+
+def _no_signal_severity(payload: SeverityRequest) -> Dict[str, Any]:
+    """Answer built from the payload itself, within validate_severity_response limits."""
+    severity_info = SEVERITY_LEVELS[payload.predicted_severity]
+    top_shap = heapq.nlargest(3, payload.shap_values, key=lambda x: abs(x.value))
+    key_factors = [f"{s.feature[:80]}: SHAP {s.value:+.3f}" for s in top_shap]
+
+    probs = payload.severity_probabilities
+    if probs:
+        top_level, top_prob = max(probs.items(), key=lambda kv: kv[1])
+        confidence_note = f"Highest probability: {top_prob*100:.1f}% for severity {top_level}"
+        if top_level != str(payload.predicted_severity):
+            predicted_prob = probs.get(str(payload.predicted_severity), 0.0)
+            confidence_note += f"; predicted severity {payload.predicted_severity} has {predicted_prob*100:.1f}%"
+        confidence_note += "."
+    else:
+        confidence_note = "No prediction probabilities were provided."
+
+    return {
+        "severity_explanation": (
+            f"No feature moved this severity {payload.predicted_severity} ({severity_info.name}) prediction "
+            f"meaningfully; it reflects the model's baseline for this kind of violation."
+        ),
+        "key_factors": key_factors,
+        "confidence_note": confidence_note,
+    }
+
+
+def _add_severity_metadata(parsed: Dict[str, Any], predicted_severity: int) -> Dict[str, Any]:
+    # predicted_severity is checked against 2-5 before this is called
+    severity_info = SEVERITY_LEVELS[predicted_severity]
+    parsed["predicted_severity"] = predicted_severity
+    parsed["severity_name"] = severity_info.name
+    parsed["severity_description"] = severity_info.description
+    return parsed
+
+
+def _fix_cache_key(payload: FixRequest) -> str:
+    return _cache_key(MODEL, "fix", payload.violation_id, payload.html_snippet, payload.target)
+
+
+def _fix_messages(payload: FixRequest) -> List[Dict[str, str]]:
+    return [
+        _SYSTEM_MESSAGE,
+        {"role": "user", "content": build_user_prompt(payload)}
+    ]
+
+
+def parse_fix_output(text_output: str) -> Dict[str, Any]:
+    """
+    Parse and validate the model's fix JSON.
+
+    Raises HTTPException if the output is not valid JSON or fails validation.
+    """
+    # Parse JSON
+    try:
+        parsed = orjson.loads(text_output)
+    except orjson.JSONDecodeError as e:
+        raise HTTPException(
+            status_code=500,
+            detail={
+                "error": "Model returned invalid JSON",
+                "raw_output": text_output,
+                "parse_error": str(e)
+            }
+        )
+
+    # Validate response structure
+    validation_error = validate_response(parsed)
+    if validation_error:
+        raise HTTPException(
+            status_code=500,
+            detail={
+                "error": "Invalid JSON schema from model",
+                "validation_error": validation_error,
+                "raw_output": parsed
+            }
+        )
+
+    return parsed
+
+
+async def generate_fix(payload: FixRequest) -> Dict[str, Any]:
+    """
+    Get validated fix guidance for one violation (cached).
+
+    Raises HTTPException if the model output is not valid JSON or fails
+    validation.
+    """
+    if _lacks_context(payload):
+        return _NO_CONTEXT_FIX
+
+    cache_key = _fix_cache_key(payload)
+    cached = _cache_get(cache_key)
+    if cached is not None:
+        return cached
+
+    # Call OpenAI API
+    async with llm_semaphore:
+        response = await openai_client.chat.completions.create(
+            model=MODEL,
+            messages=_fix_messages(payload),
+            response_format={"type": "json_object"},
+            temperature=0.2,
+            max_tokens=800
+        )
+
+    parsed = parse_fix_output(response.choices[0].message.content)
+    _cache_set(cache_key, parsed)
+    return parsed
+
+
 @app.post("/api/llm_reasons", response_model=None)
 async def fix_violation(request: Request):
     """
@@ -650,50 +979,9 @@ async def fix_violation(request: Request):
     """
     try:
         # Parse request body
-        body = await request.json()
-        payload = FixRequest(**body)
-        
-        # Call OpenAI API
-        response = openai_client.chat.completions.create(
-            model=MODEL,
-            messages=[
-                {"role": "system", "content": build_system_prompt()},
-                {"role": "user", "content": build_user_prompt(payload)}
-            ],
-            response_format={"type": "json_object"},
-            temperature=0.2,
-            max_tokens=800
-        )
-        
-        # Extract response text
-        text_output = response.choices[0].message.content
-        
-        # Parse JSON
-        try:
-            parsed = json.loads(text_output)
-        except json.JSONDecodeError as e:
-            raise HTTPException(
-                status_code=500,
-                detail={
-                    "error": "Model returned invalid JSON",
-                    "raw_output": text_output,
-                    "parse_error": str(e)
-                }
-            )
-        
-        # Validate response structure
-        validation_error = validate_response(parsed)
-        if validation_error:
-            raise HTTPException(
-                status_code=500,
-                detail={
-                    "error": "Invalid JSON schema from model",
-                    "validation_error": validation_error,
-                    "raw_output": parsed
-                }
-            )
-        
-        return parsed
+        payload = FixRequest.model_validate_json(await request.body())
+
+        return ORJSONResponse(await generate_fix(payload))
         
     except HTTPException:
         raise
@@ -708,6 +996,131 @@ async def fix_violation(request: Request):
         )
 
 
+def _sse(data: Any, event: Optional[str] = None) -> bytes:
+    """Encode one Server-Sent Event; data is JSON so chunks can hold newlines."""
+    head = f"event: {event}\n".encode() if event else b""
+    return head + b"data: " + orjson.dumps(data) + b"\n\n"
+
+
+_STREAM_END = object()
+
+
+@app.post("/api/llm_reasons_stream", response_model=None)
+async def fix_violation_stream(request: Request):
+    """
+    Streaming variant of /api/llm_reasons (Server-Sent Events).
+
+    Model output is forwarded as it is generated: each `data:` event holds a
+    JSON-encoded text chunk. The stream ends with `event: result` carrying
+    the validated fix JSON (same shape as /api/llm_reasons), or
+    `event: error` if the output failed validation.
+    """
+    try:
+        payload = FixRequest.model_validate_json(await request.body())
+    except Exception as e:
+        raise HTTPException(status_code=400, detail={"error": "Invalid request", "detail": str(e)})
+
+    async def events():
+        if _lacks_context(payload):
+            yield _sse(_NO_CONTEXT_FIX, "result")
+            return
+
+        cache_key = _fix_cache_key(payload)
+        cached = _cache_get(cache_key)
+        if cached is not None:
+            yield _sse(cached, "result")
+            return
+
+        # Only the pump task holds the semaphore, and only while reading from
+        # OpenAI; a slow client just lets the (max_tokens-bounded) queue grow
+        queue: asyncio.Queue = asyncio.Queue()
+
+        async def pump():
+            try:
+                async with llm_semaphore:
+                    stream = await openai_client.chat.completions.create(
+                        model=MODEL,
+                        messages=_fix_messages(payload),
+                        response_format={"type": "json_object"},
+                        temperature=0.2,
+                        max_tokens=800,
+                        stream=True
+                    )
+                    async for chunk in stream:
+                        if not chunk.choices:
+                            continue
+                        delta = chunk.choices[0].delta.content
+                        if delta:
+                            queue.put_nowait(delta)
+                queue.put_nowait(_STREAM_END)
+            except Exception as e:
+                queue.put_nowait(e)
+
+        pump_task = asyncio.create_task(pump())
+        try:
+            chunks = []
+            while True:
+                item = await queue.get()
+                if item is _STREAM_END:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                chunks.append(item)
+                yield _sse(item)
+
+            parsed = parse_fix_output("".join(chunks))
+        except HTTPException as e:
+            yield _sse(e.detail, "error")
+            return
+        except Exception as e:
+            print(f"❌ /api/llm_reasons_stream error: {e}")
+            yield _sse({"error": "LLM request failed", "detail": str(e)}, "error")
+            return
+        finally:
+            # Client gone or stream finished: stop reading from OpenAI
+            pump_task.cancel()
+
+        _cache_set(cache_key, parsed)
+        yield _sse(parsed, "result")
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+_FIX_BATCH_ADAPTER = TypeAdapter(List[FixRequest])
+
+
+@app.post("/api/llm_reasons_batch", response_model=None)
+async def fix_violations_batch(request: Request):
+    """
+    Fix guidance for a list of violations (e.g. every issue of a report).
+
+    Requests run concurrently, bounded by LLM_CONCURRENCY. Returns one entry
+    per input in the same order: the fix JSON, or {"error": ...} if that
+    violation failed, so one bad issue does not sink the whole batch.
+    """
+    try:
+        payloads = _FIX_BATCH_ADAPTER.validate_json(await request.body())
+    except Exception as e:
+        raise HTTPException(status_code=400, detail={"error": "Invalid request", "detail": str(e)})
+
+    results = await asyncio.gather(*(generate_fix(p) for p in payloads), return_exceptions=True)
+
+    out = []
+    for result in results:
+        if isinstance(result, HTTPException):
+            out.append(result.detail)
+        elif isinstance(result, BaseException):
+            print(f"❌ /api/llm_reasons_batch error: {result}")
+            out.append({"error": "LLM request failed", "detail": str(result)})
+        else:
+            out.append(result)
+    return ORJSONResponse(out)
+
+
 @app.post("/api/explain_severity", response_model=None)
 async def explain_severity(request: Request):
     """
@@ -717,8 +1130,7 @@ async def explain_severity(request: Request):
     """
     try:
         # Parse request body
-        body = await request.json()
-        payload = SeverityRequest(**body)
+        payload = SeverityRequest.model_validate_json(await request.body())
         
         # Validate severity level
         if payload.predicted_severity not in [2, 3, 4, 5]:
@@ -726,26 +1138,39 @@ async def explain_severity(request: Request):
                 status_code=400,
                 detail={"error": "predicted_severity must be 2, 3, 4, or 5"}
             )
+
+        # Nothing for the model to explain without SHAP signal
+        if _lacks_shap_signal(payload):
+            return ORJSONResponse(_add_severity_metadata(_no_signal_severity(payload), payload.predicted_severity))
         
+        # The SHAP values and probabilities shape the answer, so key on the
+        # whole rendered prompt
+        user_prompt = build_severity_user_prompt(payload)
+        cache_key = _cache_key(MODEL, "severity", user_prompt)
+        cached = _cache_get(cache_key)
+        if cached is not None:
+            return ORJSONResponse(cached)
+
         # Call OpenAI API
-        response = openai_client.chat.completions.create(
-            model=MODEL,
-            messages=[
-                {"role": "system", "content": build_severity_system_prompt()},
-                {"role": "user", "content": build_severity_user_prompt(payload)}
-            ],
-            response_format={"type": "json_object"},
-            temperature=0.3,
-            max_tokens=600
-        )
+        async with llm_semaphore:
+            response = await openai_client.chat.completions.create(
+                model=MODEL,
+                messages=[
+                    _SEVERITY_SYSTEM_MESSAGE,
+                    {"role": "user", "content": user_prompt}
+                ],
+                response_format={"type": "json_object"},
+                temperature=0.3,
+                max_tokens=600
+            )
         
         # Extract response text
         text_output = response.choices[0].message.content
         
         # Parse JSON
         try:
-            parsed = json.loads(text_output)
-        except json.JSONDecodeError as e:
+            parsed = orjson.loads(text_output)
+        except orjson.JSONDecodeError as e:
             raise HTTPException(
                 status_code=500,
                 detail={
@@ -768,12 +1193,10 @@ async def explain_severity(request: Request):
             )
         
         # Add metadata to response
-        severity_info = SEVERITY_LEVELS.get(payload.predicted_severity, {})
-        parsed["predicted_severity"] = payload.predicted_severity
-        parsed["severity_name"] = severity_info.get("name", f"Level {payload.predicted_severity}")
-        parsed["severity_description"] = severity_info.get("description", "")
+        _add_severity_metadata(parsed, payload.predicted_severity)
         
-        return parsed
+        _cache_set(cache_key, parsed)
+        return ORJSONResponse(parsed)
         
     except HTTPException:
         raise
@@ -791,11 +1214,11 @@ async def explain_severity(request: Request):
 
 
 
-def build_report_system_prompt() -> str:
-    return """You are an accessibility audit report writer.
+REPORT_SYSTEM_PROMPT = """You are an accessibility audit report writer.
 
-Write a comprehensive accessibility report based on a list of detected issues.
-Be detailed, structured, and action-oriented.
+Write the overview of a comprehensive accessibility report based on a list of detected issues.
+Be detailed, structured, and action-oriented. Per-issue findings are written separately;
+do not include them.
 
 RETURN ONLY valid JSON (no markdown, no extra keys).
 
@@ -812,17 +1235,6 @@ Required JSON structure:
   "prioritized_recommendations": [
     {"priority": "P0|P1|P2", "recommendation": "...", "rationale": "..."}
   ],
-  "issue_sections": [
-    {
-      "violation_id": "...",
-      "severity_level": 0,
-      "severity_name": "...",
-      "summary": "...",
-      "impact_on_users": "...",
-      "recommended_fix": "...",
-      "developer_notes": "..."
-    }
-  ],
   "next_steps": ["...", "..."]
 }
 
@@ -832,67 +1244,21 @@ Guidelines:
 - Be specific and practical for developers.
 - Keep executive_summary ~6-10 sentences. Other fields can be longer where useful.
 """
+_REPORT_SYSTEM_MESSAGE = {"role": "system", "content": REPORT_SYSTEM_PROMPT}
+_REPORT_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {"name": "report_overview", "strict": True, "schema": ReportOverviewJson.model_json_schema()},
+}
 
+REPORT_SECTION_SYSTEM_PROMPT = """You are an accessibility audit report writer.
 
-def build_report_user_prompt(payload: ReportRequest) -> str:
-    # Keep input compact but informative.
-    # You can also omit html_snippet if you want to reduce tokens.
-    issues_compact = []
-    for i in payload.issues:
-        issues_compact.append({
-            "violation_id": i.violation_id,
-            "impact": i.impact,
-            "target": i.target,
-            "help_url": i.help_url,
-            "description": i.description,
-            "fix": {
-                "whats_wrong": i.fix.whats_wrong,
-                "who_this_affects": i.fix.who_this_affects,
-                "why_it_matters": i.fix.why_it_matters,
-                "what_to_fix": i.fix.what_to_fix,
-                "how_to_fix": i.fix.how_to_fix,
-            },
-            "severity": {
-                "predicted_severity": i.severity.predicted_severity,
-                "severity_name": i.severity.severity_name,
-                "severity_explanation": i.severity.severity_explanation,
-                "key_factors": i.severity.key_factors,
-                "confidence_note": i.severity.confidence_note
-            }
-        })
-
-    return f"""
-Generate a professional accessibility report.
-
-Site: {payload.site_name}
-Scanned URL: {payload.scanned_url}
-Generated For: {payload.generated_for}
-
-Issues (JSON):
-{json.dumps(issues_compact, ensure_ascii=False)}
-""".strip()
-
-def build_report_system_prompt() -> str:
-    return """You are an accessibility audit report writer.
-
-Write a comprehensive accessibility report based on a list of detected issues.
-Be detailed, structured, and action-oriented.
+Write the findings sections of an accessibility report, one for each detected issue given,
+in the order given. Be detailed, specific, and practical for developers.
 
 RETURN ONLY valid JSON (no markdown, no extra keys).
 
 Required JSON structure:
 {
-  "title": "...",
-  "executive_summary": "...",
-  "overall_risk": "Low|Medium|High|Critical",
-  "highlights": ["...", "...", "..."],
-  "stats": {
-    "total_issues": 0,
-    "by_severity": {"2": 0, "3": 0, "4": 0, "5": 0}
-  },
-  "prioritized_recommendations": [
-    {"priority": "P0|P1|P2", "recommendation": "...", "rationale": "..."}
-  ],
   "issue_sections": [
     {
       "violation_id": "...",
@@ -903,44 +1269,57 @@ Required JSON structure:
       "recommended_fix": "...",
       "developer_notes": "..."
     }
-  ],
-  "next_steps": ["...", "..."]
+  ]
 }
 
 Guidelines:
-- Use the provided per-issue fix text and severity explanations.
-- Prioritize P0 for severity 5/4, P1 for 3, P2 for 2 unless context suggests otherwise.
-- Be specific and practical for developers.
-- Keep executive_summary ~6-10 sentences. Other fields can be longer where useful.
+- Exactly one section per issue, in the same order as the issues.
+- Use the provided fix text and severity explanation.
+- severity_level and severity_name are the issue's predicted severity.
 """
+_REPORT_SECTION_SYSTEM_MESSAGE = {"role": "system", "content": REPORT_SECTION_SYSTEM_PROMPT}
+_REPORT_SECTION_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {"name": "report_issue_sections", "strict": True, "schema": IssueSectionsJson.model_json_schema()},
+}
+# A report makes at most this many section calls (plus the overview), so large
+# reports cannot crowd interactive requests out of llm_semaphore. Issues are
+# split evenly between the calls.
+REPORT_SECTION_CALLS = int(os.getenv("REPORT_SECTION_CALLS", "4"))
+_SECTION_MAX_TOKENS = 600
+_MAX_OUTPUT_TOKENS = 16000
 
 
-def build_report_user_prompt(payload: ReportRequest) -> str:
+def _compact_issue(i: ReportIssue) -> Dict[str, Any]:
     # Keep input compact but informative.
     # You can also omit html_snippet if you want to reduce tokens.
-    issues_compact = []
-    for i in payload.issues:
-        issues_compact.append({
-            "violation_id": i.violation_id,
-            "impact": i.impact,
-            "target": i.target,
-            "help_url": i.help_url,
-            "description": i.description,
-            "fix": {
-                "whats_wrong": i.fix.whats_wrong,
-                "who_this_affects": i.fix.who_this_affects,
-                "why_it_matters": i.fix.why_it_matters,
-                "what_to_fix": i.fix.what_to_fix,
-                "how_to_fix": i.fix.how_to_fix,
-            },
-            "severity": {
-                "predicted_severity": i.severity.predicted_severity,
-                "severity_name": i.severity.severity_name,
-                "severity_explanation": i.severity.severity_explanation,
-                "key_factors": i.severity.key_factors,
-                "confidence_note": i.severity.confidence_note
-            }
-        })
+    # Plain dicts + orjson: measurably faster here than model_dump(include=...),
+    # whose include filtering costs more than building the dicts directly.
+    return {
+        "violation_id": i.violation_id,
+        "impact": i.impact,
+        "target": i.target,
+        "help_url": i.help_url,
+        "description": i.description,
+        "fix": {
+            "whats_wrong": i.fix.whats_wrong,
+            "who_this_affects": i.fix.who_this_affects,
+            "why_it_matters": i.fix.why_it_matters,
+            "what_to_fix": i.fix.what_to_fix,
+            "how_to_fix": i.fix.how_to_fix,
+        },
+        "severity": {
+            "predicted_severity": i.severity.predicted_severity,
+            "severity_name": i.severity.severity_name,
+            "severity_explanation": i.severity.severity_explanation,
+            "key_factors": i.severity.key_factors,
+            "confidence_note": i.severity.confidence_note
+        }
+    }
+
+
+def build_report_user_prompt(payload: ReportRequest) -> str:
+    issues_compact = [_compact_issue(i) for i in payload.issues]
 
     return f"""
 Generate a professional accessibility report.
@@ -950,29 +1329,45 @@ Scanned URL: {payload.scanned_url}
 Generated For: {payload.generated_for}
 
 Issues (JSON):
-{json.dumps(issues_compact, ensure_ascii=False)}
+{orjson.dumps(issues_compact).decode()}
 """.strip()
 
+
+def build_report_section_prompt(payload: ReportRequest, issues: List[ReportIssue]) -> str:
+    return f"""
+Write one findings section for each of these {len(issues)} issues.
+
+Site: {payload.site_name}
+Scanned URL: {payload.scanned_url}
+
+Issues (JSON):
+{orjson.dumps([_compact_issue(i) for i in issues]).decode()}
+""".strip()
+
+
+# Parsed once per PDF worker into a WeasyPrint stylesheet (see _load_weasyprint)
+# instead of being re-parsed from a <style> block on every render
+REPORT_CSS = """
+body { font-family: Arial, sans-serif; color: #111; }
+h1 { font-size: 24px; margin-bottom: 4px; }
+.meta { color: #444; font-size: 12px; margin-bottom: 16px; }
+.badge { display:inline-block; padding: 2px 8px; border-radius: 10px; font-size:12px; color:#fff; }
+.Critical { background:#7a0019; }
+.High, .Serious { background:#b00020; }
+.Medium, .Moderate { background:#c77700; }
+.Low, .Minor { background:#7a6a00; }
+.card { border:1px solid #ddd; padding:12px; margin: 12px 0; border-radius: 8px; }
+.small { font-size: 12px; color:#444; }
+ul { margin-top: 6px; }
+.section-title { margin-top: 18px; }
+.hr { height:1px; background:#eee; margin: 16px 0; }
+"""
+
 REPORT_TEMPLATE = """
 <!doctype html>
 <html>
 <head>
   <meta charset="utf-8">
-  <style>
-    body { font-family: Arial, sans-serif; color: #111; }
-    h1 { font-size: 24px; margin-bottom: 4px; }
-    .meta { color: #444; font-size: 12px; margin-bottom: 16px; }
-    .badge { display:inline-block; padding: 2px 8px; border-radius: 10px; font-size:12px; color:#fff; }
-    .Critical { background:#7a0019; }
-    .High, .Serious { background:#b00020; }
-    .Medium, .Moderate { background:#c77700; }
-    .Low, .Minor { background:#7a6a00; }
-    .card { border:1px solid #ddd; padding:12px; margin: 12px 0; border-radius: 8px; }
-    .small { font-size: 12px; color:#444; }
-    ul { margin-top: 6px; }
-    .section-title { margin-top: 18px; }
-    .hr { height:1px; background:#eee; margin: 16px 0; }
-  </style>
 </head>
 <body>
   <h1>{{ report.title }}</h1>
@@ -1001,7 +1396,7 @@ REPORT_TEMPLATE = """
 
     <h3 class="section-title">Stats</h3>
     <div class="small">Total issues: {{ report.stats.total_issues }}</div>
-    <div class="small">By severity: 2={{ report.stats.by_severity["2"] }}, 3={{ report.stats.by_severity["3"] }}, 4={{ report.stats.by_severity["4"] }}, 5={{ report.stats.by_severity["5"] }}</div>
+    <div class="small">By severity: 2={{ report.stats.by_severity.severity_2 }}, 3={{ report.stats.by_severity.severity_3 }}, 4={{ report.stats.by_severity.severity_4 }}, 5={{ report.stats.by_severity.severity_5 }}</div>
   </div>
 
   <div class="card">
@@ -1039,79 +1434,87 @@ REPORT_TEMPLATE = """
 </html>
 """
 
-@app.post("/api/generate_report_html", response_class=HTMLResponse)
-async def generate_html_report(request: Request):
-    """
-    Generate HTML report that user can save as PDF using browser's Print to PDF.
-    Much simpler than WeasyPrint - no extra dependencies needed!
-    """
-    try:
-        body = await request.json()
-        payload = ReportRequest(**body)
+# Report timestamps have minute resolution, so the formatted string is reused
+# until the minute changes
+_TS_CACHE = {"minute": -1, "value": ""}
+
+
+def _now_stamp() -> str:
+    minute = int(time.time()) // 60
+    if minute != _TS_CACHE["minute"]:
+        _TS_CACHE["value"] = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M UTC")
+        _TS_CACHE["minute"] = minute
+    return _TS_CACHE["value"]
 
-        # Build styled HTML report
-        html = f"""
+
+# Compiled once; rendering is all that happens per request
+_JINJA_ENV = Environment(loader=BaseLoader(), autoescape=True, auto_reload=False, keep_trailing_newline=True)
+_REPORT_TEMPLATE = _JINJA_ENV.from_string(REPORT_TEMPLATE)
+
+
+# Browser-printable report, streamed by /api/generate_report_html as the static
+# head, the rendered head, one fragment per issue, then the static footer
+HTML_REPORT_STATIC_HEAD = """
 <!DOCTYPE html>
 <html>
 <head>
     <meta charset="utf-8">
-    <title>Accessibility Report - {payload.site_name or 'Website'}</title>
     <style>
-        body {{
+        body {
             font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Arial, sans-serif;
             line-height: 1.6;
             color: #333;
             max-width: 900px;
             margin: 40px auto;
             padding: 20px;
-        }}
-        h1 {{ color: #1e293b; margin-bottom: 10px; }}
-        .meta {{ color: #666; font-size: 14px; margin-bottom: 30px; }}
-        .summary {{
+        }
+        h1 { color: #1e293b; margin-bottom: 10px; }
+        .meta { color: #666; font-size: 14px; margin-bottom: 30px; }
+        .summary {
             background: #f8fafc;
             border-left: 4px solid #3b82f6;
             padding: 20px;
             margin: 20px 0;
             border-radius: 4px;
-        }}
-        .issue {{
+        }
+        .issue {
             border: 1px solid #e5e7eb;
             border-radius: 8px;
             padding: 20px;
             margin: 20px 0;
             break-inside: avoid;
-        }}
-        .critical {{ border-left: 4px solid #dc2626; }}
-        .serious {{ border-left: 4px solid #ea580c; }}
-        .moderate {{ border-left: 4px solid #f59e0b; }}
-        .minor {{ border-left: 4px solid #84cc16; }}
-        .badge {{
+        }
+        .critical { border-left: 4px solid #dc2626; }
+        .serious { border-left: 4px solid #ea580c; }
+        .moderate { border-left: 4px solid #f59e0b; }
+        .minor { border-left: 4px solid #84cc16; }
+        .badge {
             display: inline-block;
             padding: 4px 12px;
             border-radius: 12px;
             font-size: 12px;
             font-weight: 600;
             color: white;
-        }}
-        .badge-critical {{ background: #dc2626; }}
-        .badge-serious {{ background: #ea580c; }}
-        .badge-moderate {{ background: #f59e0b; }}
-        .badge-minor {{ background: #84cc16; }}
-        .section {{ margin: 15px 0; }}
-        .section-title {{ font-weight: 600; color: #1e293b; margin-bottom: 8px; }}
-        .code {{ 
+        }
+        .badge-critical { background: #dc2626; }
+        .badge-serious { background: #ea580c; }
+        .badge-moderate { background: #f59e0b; }
+        .badge-minor { background: #84cc16; }
+        .section { margin: 15px 0; }
+        .section-title { font-weight: 600; color: #1e293b; margin-bottom: 8px; }
+        .code { 
             background: #f1f5f9; 
             padding: 2px 6px; 
             border-radius: 3px; 
             font-family: monospace;
             font-size: 13px;
-        }}
-        @media print {{
-            body {{ margin: 0; padding: 20px; }}
-            .issue {{ page-break-inside: avoid; }}
-            .print-button {{ display: none; }}
-        }}
-        .print-button {{
+        }
+        @media print {
+            body { margin: 0; padding: 20px; }
+            .issue { page-break-inside: avoid; }
+            .print-button { display: none; }
+        }
+        .print-button {
             position: fixed;
             top: 20px;
             right: 20px;
@@ -1124,94 +1527,82 @@ async def generate_html_report(request: Request):
             font-weight: 600;
             box-shadow: 0 4px 6px rgba(0,0,0,0.1);
             z-index: 1000;
-        }}
-        .print-button:hover {{ background: #2563eb; }}
+        }
+        .print-button:hover { background: #2563eb; }
     </style>
+"""
+
+HTML_REPORT_HEAD = """    <title>Accessibility Report - {{ site_name or 'Website' }}</title>
 </head>
 <body>
     <button class="print-button" onclick="window.print()">📄 Save as PDF</button>
     
     <h1>Accessibility Report</h1>
     <div class="meta">
-        Generated: {datetime.now().strftime("%Y-%m-%d %H:%M UTC")}<br>
-        Site: {payload.site_name or 'N/A'}<br>
-        URL: {payload.scanned_url or 'N/A'}<br>
-        For: {payload.generated_for or 'N/A'}
+        Generated: {{ generated_at }}<br>
+        Site: {{ site_name or 'N/A' }}<br>
+        URL: {{ scanned_url or 'N/A' }}<br>
+        For: {{ generated_for or 'N/A' }}
     </div>
 
     <div class="summary">
         <h2>Summary</h2>
-        <p><strong>Total Issues:</strong> {len(payload.issues)}</p>
+        <p><strong>Total Issues:</strong> {{ issues|length }}</p>
         <p>
-            Critical: {sum(1 for i in payload.issues if i.impact == 'critical')} | 
-            Serious: {sum(1 for i in payload.issues if i.impact == 'serious')} | 
-            Moderate: {sum(1 for i in payload.issues if i.impact == 'moderate')} | 
-            Minor: {sum(1 for i in payload.issues if i.impact == 'minor')}
+            Critical: {{ counts['critical'] }} | 
+            Serious: {{ counts['serious'] }} | 
+            Moderate: {{ counts['moderate'] }} | 
+            Minor: {{ counts['minor'] }}
         </p>
     </div>
 
     <h2>Issues Found</h2>
 """
 
-        # Add each issue
-        for idx, issue in enumerate(payload.issues, 1):
-            severity_class = issue.impact or 'moderate'
-            
-            html += f"""
-    <div class="issue {severity_class}">
+HTML_REPORT_ISSUE = """
+    <div class="issue {{ severity_class }}">
         <div style="display: flex; justify-content: space-between; align-items: start; margin-bottom: 15px;">
-            <h3 style="margin: 0;">#{idx}: {issue.violation_id}</h3>
-            <span class="badge badge-{severity_class}">{issue.impact.upper() if issue.impact else 'UNKNOWN'}</span>
+            <h3 style="margin: 0;">#{{ idx }}: {{ issue.violation_id }}</h3>
+            <span class="badge badge-{{ severity_class }}">{{ impact_label }}</span>
         </div>
-        
+        {% if issue.fix.whats_wrong %}
         <div class="section">
             <div class="section-title">What's wrong:</div>
-            <p>{issue.fix.whats_wrong}</p>
+            <p>{{ issue.fix.whats_wrong }}</p>
         </div>
-
+{% endif %}{% if issue.fix.who_this_affects %}
         <div class="section">
             <div class="section-title">Who this affects:</div>
-            <p>{issue.fix.who_this_affects}</p>
+            <p>{{ issue.fix.who_this_affects }}</p>
         </div>
-
+{% endif %}{% if issue.fix.why_it_matters %}
         <div class="section">
             <div class="section-title">Why it matters:</div>
-            <p>{issue.fix.why_it_matters}</p>
+            <p>{{ issue.fix.why_it_matters }}</p>
         </div>
-
+{% endif %}{% if issue.fix.how_to_fix %}
         <div class="section">
             <div class="section-title">How to fix:</div>
-            <p>{issue.fix.how_to_fix}</p>
+            <p>{{ issue.fix.how_to_fix }}</p>
         </div>
-"""
-
-            # Add severity explanation if available
-            if issue.severity:
-                html += f"""
+{% endif %}{% if issue.severity and issue.severity.severity_explanation %}
         <div class="section" style="background: #fef3c7; padding: 12px; border-radius: 4px;">
             <div class="section-title">🧠 ML Severity Analysis:</div>
-            <p>{issue.severity.severity_explanation}</p>
+            <p>{{ issue.severity.severity_explanation }}</p>
             <p style="font-size: 13px; color: #666;">
-                Predicted: {issue.severity.predicted_severity}/5 | {issue.severity.confidence_note}
+                Predicted: {{ issue.severity.predicted_severity }}/5 | {{ issue.severity.confidence_note }}
             </p>
         </div>
-"""
-
-            # Add target info
-            if issue.target:
-                html += f"""
+{% endif %}{% if issue.target %}
         <div class="section">
             <div class="section-title">Location:</div>
-            <code class="code">{issue.target}</code>
+            <code class="code">{{ issue.target }}</code>
         </div>
-"""
-
-            html += """
+{% endif %}
     </div>
 """
 
-        # Close HTML
-        html += """
+HTML_REPORT_FOOT = """
     <div class="meta" style="margin-top: 40px; padding-top: 20px; border-top: 1px solid #e5e7eb; text-align: center;">
         Generated by <strong>AccessGuru</strong> | Powered by AI
     </div>
@@ -1223,52 +1614,245 @@ async def generate_html_report(request: Request):
 </body>
 </html>
 """
+# The static parts never change, so they are encoded once
+_HTML_REPORT_STATIC_HEAD = HTML_REPORT_STATIC_HEAD.encode("utf-8")
+_HTML_REPORT_FOOT = HTML_REPORT_FOOT.encode("utf-8")
+_HTML_REPORT_HEAD = _JINJA_ENV.from_string(HTML_REPORT_HEAD)
+_HTML_REPORT_ISSUE = _JINJA_ENV.from_string(HTML_REPORT_ISSUE)
+
+# impact -> (card/badge CSS class, badge label); a missing impact is styled
+# as moderate but labelled UNKNOWN
+_IMPACT_META: Dict[Optional[str], Tuple[str, str]] = {
+    impact: (impact, impact.upper()) for impact in ("critical", "serious", "moderate", "minor")
+}
+_IMPACT_META[None] = _IMPACT_META[""] = ("moderate", "UNKNOWN")
+
 
-        return HTMLResponse(content=html)
+def _impact_meta(impact: Optional[str]) -> Tuple[str, str]:
+    meta = _IMPACT_META.get(impact)
+    return meta if meta is not None else (impact, impact.upper())
+
+
+@app.post("/api/generate_report_html", response_class=HTMLResponse)
+async def generate_html_report(request: Request):
+    """
+    Generate HTML report that user can save as PDF using browser's Print to PDF.
+    Much simpler than WeasyPrint - no extra dependencies needed!
+    """
+    try:
+        payload = parse_report_request(await request.body())
+
+        # Head is rendered up front so a bad payload still fails with a 500
+        head = _HTML_REPORT_HEAD.render(
+            issues=payload.issues,
+            counts=Counter(i.impact for i in payload.issues),
+            generated_at=_now_stamp(),
+            site_name=payload.site_name,
+            scanned_url=payload.scanned_url,
+            generated_for=payload.generated_for
+        )
+
+        async def body_iter():
+            yield _HTML_REPORT_STATIC_HEAD
+            yield head
+            for idx, issue in enumerate(payload.issues, 1):
+                severity_class, impact_label = _impact_meta(issue.impact)
+                yield _HTML_REPORT_ISSUE.render(
+                    issue=issue, idx=idx, severity_class=severity_class, impact_label=impact_label
+                )
+            yield _HTML_REPORT_FOOT
+
+        return StreamingResponse(body_iter(), media_type="text/html")
 
     except Exception as e:
         print(f"HTML report generation error: {e}")
         raise HTTPException(status_code=500, detail={"error": "Report generation failed", "detail": str(e)})
 
 
-@app.post("/api/generate_report", response_model=None)
-async def generate_accessibility_report_pdf(request: Request):
+# WeasyPrint is slow to import and to lay out its first document, and is only
+# needed by /api/generate_report, so each PDF worker loads it on first use.
+# The report stylesheet and font configuration are built once and reused.
+_weasyprint: Optional[Tuple[Any, Any, Any]] = None
+
+
+def _load_weasyprint():
+    global _weasyprint
+    if _weasyprint is None:
+        from weasyprint import CSS, HTML
+        from weasyprint.text.fonts import FontConfiguration
+        fonts = FontConfiguration()
+        stylesheet = CSS(string=REPORT_CSS, font_config=fonts)
+        HTML(string="<p></p>").write_pdf(stylesheets=[stylesheet], font_config=fonts)
+        _weasyprint = (HTML, stylesheet, fonts)
+    return _weasyprint
+
+
+def _init_pdf_worker():
+    # A failing initializer would break the whole pool; let _render_pdf
+    # report the error per request instead
     try:
-        body = await request.json()
-        payload = ReportRequest(**body)
+        _load_weasyprint()
+    except Exception:
+        pass
+
+
+def _render_pdf(html_str: str) -> bytes:
+    HTML, stylesheet, fonts = _load_weasyprint()
+    return HTML(string=html_str).write_pdf(stylesheets=[stylesheet], font_config=fonts)
+
+
+# Headless Chromium (optional: pip install playwright && playwright install
+# chromium) prints a report in a fraction of WeasyPrint's time. One browser and
+# context per worker process are launched on first use and shared by all
+# requests; without Playwright or Chromium, PDFs fall back to WeasyPrint. A
+# browser that disconnects (crash, OOM kill) is dropped and relaunched.
+_chromium: Optional[Tuple[Any, Any, Any]] = None
+_chromium_unavailable = False
+_chromium_lock = asyncio.Lock()
+# WeasyPrint's default page margin, so both renderers lay out alike
+_PDF_MARGIN = {"top": "75px", "right": "75px", "bottom": "75px", "left": "75px"}
+
+
+async def _get_chromium():
+    global _chromium, _chromium_unavailable
+    if _chromium is not None and not _chromium[1].is_connected():
+        await _drop_chromium(_chromium)
+    if _chromium is None and not _chromium_unavailable:
+        async with _chromium_lock:
+            if _chromium is None and not _chromium_unavailable:
+                playwright = None
+                try:
+                    from playwright.async_api import async_playwright
+                    playwright = await async_playwright().start()
+                    browser = await playwright.chromium.launch()
+                    _chromium = (playwright, browser, await browser.new_context())
+                except Exception as e:
+                    _chromium_unavailable = True
+                    if playwright is not None:
+                        await playwright.stop()
+                    print(f"Chromium unavailable, rendering PDFs with WeasyPrint: {e}")
+    return _chromium
+
+
+async def _drop_chromium(chromium):
+    global _chromium
+    if _chromium is not chromium:
+        return  # already dropped (and maybe relaunched) by another request
+    _chromium = None
+    playwright, browser, _ = chromium
+    for close in (browser.close, playwright.stop):
+        try:
+            await close()
+        except Exception:
+            pass
+
+
+async def _warm_pdf_renderer():
+    if await _get_chromium() is None:
+        await asyncio.get_running_loop().run_in_executor(_pdf_pool, _init_pdf_worker)
+
 
-        # 1) LLM creates the report JSON
-        llm_resp = openai_client.chat.completions.create(
+async def _render_report_pdf(html_str: str) -> bytes:
+    chromium = await _get_chromium()
+    if chromium is not None:
+        page = None
+        try:
+            page = await chromium[2].new_page()
+            await page.set_content(html_str)
+            await page.add_style_tag(content=REPORT_CSS)
+            return await page.pdf(format="A4", print_background=True, margin=_PDF_MARGIN)
+        except Exception as e:
+            print(f"Chromium render failed, falling back to WeasyPrint: {e}")
+            await _drop_chromium(chromium)
+        finally:
+            if page is not None:
+                try:
+                    await page.close()
+                except Exception:
+                    pass
+
+    return await asyncio.get_running_loop().run_in_executor(_pdf_pool, _render_pdf, html_str)
+
+
+async def _write_report_part(messages, response_format, model_cls, max_tokens: int):
+    async with llm_semaphore:
+        llm_resp = await openai_client.chat.completions.create(
             model=MODEL,
-            messages=[
-                {"role": "system", "content": build_report_system_prompt()},
-                {"role": "user", "content": build_report_user_prompt(payload)},
-            ],
-            response_format={"type": "json_object"},
+            messages=messages,
+            response_format=response_format,
             temperature=0.4,
-            max_tokens=2000
+            max_tokens=max_tokens
         )
 
-        text_output = llm_resp.choices[0].message.content
-        try:
-            report_obj = json.loads(text_output)
-        except json.JSONDecodeError as e:
-            raise HTTPException(
-                status_code=500,
-                detail={"error": "Model returned invalid JSON", "raw_output": text_output, "parse_error": str(e)}
-            )
+    text_output = llm_resp.choices[0].message.content
+    try:
+        return model_cls.model_validate_json(text_output)
+    except ValidationError as e:
+        raise HTTPException(
+            status_code=500,
+            detail={"error": "Model returned invalid JSON", "raw_output": text_output, "parse_error": str(e)}
+        )
+
+
+async def _write_report_sections(payload: ReportRequest, issues: List[ReportIssue]) -> List[IssueSectionJson]:
+    sections = await _write_report_part(
+        [_REPORT_SECTION_SYSTEM_MESSAGE, {"role": "user", "content": build_report_section_prompt(payload, issues)}],
+        _REPORT_SECTION_RESPONSE_FORMAT, IssueSectionsJson,
+        max_tokens=min(_SECTION_MAX_TOKENS * len(issues), _MAX_OUTPUT_TOKENS)
+    )
+    if len(sections.issue_sections) != len(issues):
+        raise HTTPException(
+            status_code=500,
+            detail={"error": f"Model returned {len(sections.issue_sections)} sections for {len(issues)} issues"}
+        )
+    return sections.issue_sections
+
+
+async def _gather_or_cancel(*aws):
+    """asyncio.gather that cancels the other calls as soon as one fails, so a
+    rejected section does not leave the rest spending tokens."""
+    tasks = [asyncio.ensure_future(aw) for aw in aws]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+
+
+@app.post("/api/generate_report", response_model=None)
+async def generate_accessibility_report_pdf(request: Request):
+    try:
+        payload = parse_report_request(await request.body())
+
+        # 1) LLM writes the overview and the issue sections (in at most
+        # REPORT_SECTION_CALLS batches) concurrently; the PDF renderer
+        # (Chromium, or a WeasyPrint worker) starts meanwhile
+        issues = payload.issues
+        batch_size = -(-len(issues) // max(1, REPORT_SECTION_CALLS)) or 1
+        overview, _, *section_batches = await _gather_or_cancel(
+            _write_report_part(
+                [_REPORT_SYSTEM_MESSAGE, {"role": "user", "content": build_report_user_prompt(payload)}],
+                _REPORT_RESPONSE_FORMAT, ReportOverviewJson, max_tokens=1500
+            ),
+            _warm_pdf_renderer(),
+            *(
+                _write_report_sections(payload, issues[start:start + batch_size])
+                for start in range(0, len(issues), batch_size)
+            ),
+        )
+        issue_sections = [section for batch in section_batches for section in batch]
+        report_obj = ReportJson.model_construct(**dict(overview), issue_sections=issue_sections)
 
-        env = Environment(loader=BaseLoader(), autoescape=True)
-        template = env.from_string(REPORT_TEMPLATE)
-        html_str = template.render(
+        html_str = _REPORT_TEMPLATE.render(
             report=report_obj,
-            generated_at=datetime.now(datetime.UTC).strftime("%Y-%m-%d %H:%M UTC"),
+            generated_at=_now_stamp(),
             site_name=payload.site_name or "",
             scanned_url=payload.scanned_url or "",
             generated_for=payload.generated_for or ""
         )
 
-        pdf_bytes = HTML(string=html_str).write_pdf()
+        pdf_bytes = await _render_report_pdf(html_str)
 
         filename = "accessibility-report.pdf"
         return StreamingResponse(
@@ -1288,7 +1872,16 @@ async def generate_accessibility_report_pdf(request: Request):
 
 
 if __name__ == "__main__":
-    print(f"AccessGuru LLM server starting on http://localhost:{PORT}")
+    # "auto" picks uvloop / httptools when installed (uvicorn[standard])
+    print(f"AccessGuru LLM server starting on http://localhost:{PORT} ({WORKERS} workers)")
     print(f"   Model: {MODEL}")
     print(f"   Health check: http://localhost:{PORT}/health")
-    uvicorn.run(app, host="0.0.0.0", port=PORT)
\ No newline at end of file
+    uvicorn.run(
+        "llm_reasons:app",
+        app_dir=os.path.dirname(os.path.abspath(__file__)),
+        host="0.0.0.0",
+        port=PORT,
+        workers=WORKERS,
+        loop="auto",
+        http="auto",
+    )
\ No newline at end of file
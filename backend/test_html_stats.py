@@ -0,0 +1,42 @@
+"""Parity checks: app._html_stats against the BeautifulSoup features train_model.py uses."""
+
+import pytest
+from bs4 import BeautifulSoup
+
+from app import _html_stats
+
+CASES = [
+    "<div><a href='#'>Home</a> <span>x</span><img src='a.png'></div>",
+    "<ul><li>one<li>two</ul><h2>Title</h2><button>Go</button>",
+    "<p>a <script>var x = 1;</script> b <style>p{}</style></p>",
+    "<pre>  a  </pre><p>   </p><textarea> b </textarea>",
+    "<p>a<!-- note -->b<!x>c<?pi?>d</p>",
+    # entity and character references are resolved the way bs4 does it
+    "<p>x&amp...</p>",
+    "<p>&ampx;y</p>",
+    "<p>a&window;b</p>",
+    "<p>a&&window.x</p>",
+    "<p>x&amp",
+    "<div>x &copy y &notin; &#65 &#x41; &#150; &#129; &#0; &#99999999; &bogus; &</div>",
+    # CDATA sections count as text
+    "<p>a<![CDATA[x]]>b</p>",
+    "<p>a<![CDATA[]]>b</p>",
+    "<pre>a<![CDATA[  ]]></pre>",
+]
+
+
+@pytest.mark.parametrize("html", CASES)
+def test_html_stats_matches_bs4(html):
+    soup = BeautifulSoup(html, "html.parser")
+    tags = soup.find_all()
+    stats = _html_stats(html)
+
+    assert stats.tag_count == len(tags)
+    assert stats.total_text_len == sum(len(t.get_text()) for t in tags)
+    assert stats.counts["num_links"] == len(soup.find_all("a"))
+    assert stats.counts["num_images"] == len(soup.find_all(["img", "svg"]))
+    assert stats.counts["num_buttons"] == len(soup.find_all("button"))
+    assert stats.counts["num_lists"] == len(soup.find_all(["ul", "ol", "li"]))
+    assert stats.counts["num_headings"] == len(soup.find_all(["h1", "h2", "h3", "h4", "h5", "h6"]))
+    assert stats.counts["num_divs"] == len(soup.find_all("div"))
+    assert stats.counts["num_spans"] == len(soup.find_all("span"))
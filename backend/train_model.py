@@ -254,7 +254,42 @@ def train_and_save_model(csv_path='Access_to_Tech_Dataset.csv', model_dir='model
     return xgb_clf, artifacts, X_test, y_test
 
 
+def compile_treelite_library(model_dir='models', toolchain='gcc'):
+    """Compile the saved XGBoost model to a native shared library with Treelite.
+
+    The ML API picks up `{model_dir}/xgb_model.so` for predictions when
+    treelite_runtime is installed; it is optional and skipped otherwise,
+    including with Treelite 4+, whose API this does not support.
+    """
+    try:
+        import treelite
+    except ImportError:
+        print("Treelite not installed, skipping native model compilation.")
+        return None
+
+    libpath = f'{model_dir}/xgb_model.so'
+    booster = xgb.Booster()
+    booster.load_model(f'{model_dir}/xgb_model.json')
+    try:
+        tl_model = treelite.Model.from_xgboost(booster)
+        export_lib = tl_model.export_lib
+    except AttributeError:
+        # Treelite 4 moved compilation out to TL2cgen and dropped treelite_runtime
+        print(f"Treelite {getattr(treelite, '__version__', '?')} has no export_lib "
+              "(needs treelite<4), skipping native model compilation.")
+        return None
+    export_lib(
+        toolchain=toolchain,
+        libpath=libpath,
+        params={'parallel_comp': 8},
+        verbose=False,
+    )
+    print(f"Compiled Treelite library to {libpath}")
+    return libpath
+
+
 if __name__ == "__main__":
     # Train and save the model
     model, artifacts, X_test, y_test = train_and_save_model()
     print("\nModel saved successfully!")
+    compile_treelite_library()